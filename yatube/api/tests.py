@@ -0,0 +1,124 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='api_author')
+        cls.reader = User.objects.create_user(username='api_reader')
+        cls.group = Group.objects.create(title='Группа', slug='api',
+                                         description='Описание')
+        for number in range(15):
+            cls.post = Post.objects.create(author=cls.author,
+                                           group=cls.group,
+                                           text=f'Пост {number}')
+        for number in range(12):
+            Comment.objects.create(post=cls.post, author=cls.reader,
+                                   text=f'Комментарий {number}')
+
+    def setUp(self):
+        cache.clear()
+        self.guest = Client()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def collect(self, client, url):
+        """Проходит все страницы по ссылкам next."""
+        items = []
+        while url:
+            data = client.get(url).json()
+            items.extend(data['results'])
+            url = data['next']
+        return items
+
+    def test_feeds_walk_all_posts(self):
+        """Ленты отдают каждый пост один раз, от новых к старым."""
+        expected = list(Post.objects.filter(author=self.author)
+                        .values_list('pk', flat=True))
+        urls = (
+            reverse('api:index'),
+            reverse('api:group_list', kwargs={'slug': self.group.slug}),
+            reverse('api:profile',
+                    kwargs={'username': self.author.username}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                items = self.collect(self.guest, url)
+                self.assertEqual([item['id'] for item in items], expected)
+
+    def test_post_fields(self):
+        """Пост сериализуется без вложенных объектов."""
+        response = self.guest.get(
+            reverse('api:post_detail', kwargs={'post_id': self.post.pk}))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['text'], self.post.text)
+        self.assertEqual(data['author'], self.author.username)
+        self.assertEqual(data['group'], self.group.slug)
+        self.assertIsNone(data['image'])
+        self.assertEqual(data['comments_count'], 12)
+
+    def test_comments_pages(self):
+        """Комментарии идут по курсору от новых к старым."""
+        items = self.collect(self.guest, reverse(
+            'api:comments', kwargs={'post_id': self.post.pk}))
+        self.assertEqual(
+            [item['id'] for item in items],
+            list(self.post.comments.values_list('pk', flat=True)))
+
+    def test_follow_feed(self):
+        """Лента подписок доступна только авторизованному."""
+        url = reverse('api:follow_index')
+        self.assertEqual(self.guest.get(url).status_code, 401)
+        self.assertEqual(self.collect(self.client, url), [])
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(len(self.collect(self.client, url)), 15)
+
+    def test_not_found(self):
+        """Несуществующие объекты отдают 404 в JSON."""
+        urls = (
+            reverse('api:group_list', kwargs={'slug': 'missing'}),
+            reverse('api:profile', kwargs={'username': 'missing'}),
+            reverse('api:post_detail', kwargs={'post_id': 0}),
+            reverse('api:comments', kwargs={'post_id': 0}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.guest.get(url)
+                self.assertEqual(response.status_code, 404)
+                self.assertIn('detail', response.json())
+
+    def test_conditional_get(self):
+        """Неизменившаяся лента отдаёт 304, новый пост меняет ETag."""
+        url = reverse('api:index')
+        etag = self.guest.get(url)['ETag']
+        response = self.guest.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Post.objects.create(author=self.author, text='Новый')
+        response = self.guest.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_follow_changes_feed_etag(self):
+        """Подписка меняет ETag ленты подписок."""
+        url = reverse('api:follow_index')
+        etag = self.client.get(url)['ETag']
+        Follow.objects.create(user=self.reader, author=self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_feed_is_one_query(self):
+        """
+        Страница ленты - один запрос к постам без N+1; общая лента
+        не читает сессию даже у авторизованного.
+        """
+        for client in (self.guest, self.client):
+            with self.subTest(client=client), self.assertNumQueries(1):
+                client.get(reverse('api:index'))
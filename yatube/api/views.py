@@ -0,0 +1,124 @@
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.utils.http import urlencode
+
+from posts import etags
+from posts.models import Comment, Group, Post
+from posts.timeline import timeline_posts
+from posts.utils import cursor_page
+
+User = get_user_model()
+
+# только нужные столбцы: словари из values() вместо моделей
+POST_FIELDS = ('id', 'text', 'pub_date', 'author__username', 'group__slug',
+               'image', 'comments_count')
+COMMENT_FIELDS = ('id', 'text', 'created', 'author__username')
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status,
+                        json_dumps_params={'ensure_ascii': False})
+
+
+def error(detail, status):
+    return json_response({'detail': detail}, status)
+
+
+def post_json(row):
+    return {
+        'id': row['id'],
+        'text': row['text'],
+        'pub_date': row['pub_date'],
+        'author': row['author__username'],
+        'group': row['group__slug'],
+        'image': default_storage.url(row['image']) if row['image'] else None,
+        'comments_count': row['comments_count'],
+    }
+
+
+def comment_json(row):
+    return {
+        'id': row['id'],
+        'text': row['text'],
+        'created': row['created'],
+        'author': row['author__username'],
+    }
+
+
+def page_json(request, rows, serialize, field='pub_date', tiebreak='id'):
+    """Страница по курсору с адресами соседних страниц."""
+    page = cursor_page(rows, request.GET.get('cursor'),
+                       field=field, tiebreak=tiebreak)
+
+    def link(cursor):
+        if cursor is None:
+            return None
+        return request.build_absolute_uri(
+            f'{request.path}?{urlencode({"cursor": cursor})}')
+
+    return {
+        'results': [serialize(row) for row in page],
+        'next': link(page.next_cursor),
+        'previous': link(page.previous_cursor),
+    }
+
+
+@etags.conditional(etags.index_state, per_user=False)
+def index(request):
+    return json_response(page_json(
+        request, Post.objects.values(*POST_FIELDS), post_json))
+
+
+@etags.conditional(etags.group_state, per_user=False)
+def group_posts(request, slug):
+    # фильтр через JOIN: группа ищется отдельно, только если
+    # страница пуста
+    data = page_json(
+        request,
+        Post.objects.filter(group__slug=slug).values(*POST_FIELDS),
+        post_json,
+    )
+    if not data['results'] and not Group.objects.filter(slug=slug).exists():
+        return error('Группа не найдена.', 404)
+    return json_response(data)
+
+
+@etags.conditional(etags.profile_state, per_user=False)
+def profile(request, username):
+    data = page_json(
+        request,
+        Post.objects.filter(author__username=username).values(*POST_FIELDS),
+        post_json,
+    )
+    if (not data['results']
+            and not User.objects.filter(username=username).exists()):
+        return error('Автор не найден.', 404)
+    return json_response(data)
+
+
+@etags.conditional(etags.follow_state)
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return error('Нужна авторизация.', 401)
+    posts = timeline_posts(request.user).values(
+        *POST_FIELDS, 'feed_date', 'feed_post')
+    return json_response(page_json(request, posts, post_json,
+                                   field='feed_date', tiebreak='feed_post'))
+
+
+@etags.conditional(etags.post_state, per_user=False)
+def post_detail(request, post_id):
+    row = Post.objects.filter(pk=post_id).values(*POST_FIELDS).first()
+    if row is None:
+        return error('Пост не найден.', 404)
+    return json_response(post_json(row))
+
+
+@etags.conditional(etags.post_state, per_user=False)
+def comments(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        return error('Пост не найден.', 404)
+    rows = Comment.objects.filter(post_id=post_id).values(*COMMENT_FIELDS)
+    return json_response(page_json(request, rows, comment_json,
+                                   field='created'))
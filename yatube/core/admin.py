@@ -0,0 +1,21 @@
+from django.contrib import admin
+
+from .models import Task
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'name',
+        'status',
+        'priority',
+        'attempts',
+        'run_at',
+        'finished_at',
+    )
+    search_fields = ('name', 'key')
+    list_filter = ('status', 'name')
+    empty_value_display = '-пусто-'
+
+
+admin.site.register(Task, TaskAdmin)
@@ -0,0 +1,218 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# время последнего чтения обновляется не чаще раза в столько секунд:
+# запись на каждый get мешала бы читателям других процессов
+ACCESS_RESOLUTION = 10
+BUSY_TIMEOUT = 5
+# переполнение проверяется не на каждой записи: COUNT(*) обходит таблицу
+CULL_EVERY = 50
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    'key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+)
+
+
+def dumps(value):
+    # числа хранятся как есть, чтобы incr выполнялся одним UPDATE
+    if type(value) in (int, float):
+        return value
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def loads(value):
+    if isinstance(value, bytes):
+        return pickle.loads(value)
+    return value
+
+
+class SQLiteCache(BaseCache):
+    """
+    Кеш в файле SQLite в режиме WAL, общий для всех процессов сервера.
+
+    LOCATION - путь к файлу базы. Просроченные записи и, при превышении
+    MAX_ENTRIES, давно не читавшиеся записи удаляются при записи в кеш.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+        self._writes = 0
+
+    @property
+    def _connection(self):
+        # соединение SQLite нельзя использовать после fork и из другого потока
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=BUSY_TIMEOUT,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for sql in SCHEMA:
+                conn.execute(sql)
+            self._local.connection = conn
+            self._local.pid = pid
+        return self._local.connection
+
+    def _write(self, callback):
+        """Выполняет callback(conn) в транзакции с блокировкой записи."""
+        conn = self._connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = callback(conn)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        cursor = self._write(lambda conn: conn.execute(
+            'INSERT INTO cache VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+            'expires = excluded.expires, accessed = excluded.accessed '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (key, dumps(value), self.get_backend_timeout(timeout), now, now),
+        ))
+        if cursor.rowcount:
+            self._maybe_cull()
+        return bool(cursor.rowcount)
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return {}
+        names = {self._key(key, version): key for key in keys}
+        now = time.time()
+        placeholders = ', '.join('?' * len(names))
+        rows = self._connection.execute(
+            'SELECT key, value, accessed FROM cache '
+            f'WHERE key IN ({placeholders}) '
+            'AND (expires IS NULL OR expires > ?)',
+            [*names, now],
+        ).fetchall()
+        stale = [name for name, _, accessed in rows
+                 if accessed < now - ACCESS_RESOLUTION]
+        if stale:
+            self._connection.execute(
+                'UPDATE cache SET accessed = ? '
+                f'WHERE key IN ({", ".join("?" * len(stale))})',
+                [now, *stale],
+            )
+        return {names[name]: loads(value) for name, value, _ in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        rows = [(self._key(key, version), dumps(value), expires, now)
+                for key, value in data.items()]
+        self._write(lambda conn: conn.executemany(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', rows))
+        self._maybe_cull()
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        cursor = self._connection.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return bool(cursor.rowcount)
+
+    def incr(self, key, delta=1, version=None):
+        """Атомарно, без чтения значения в Python."""
+        key = self._key(key, version)
+
+        def increment(conn):
+            now = time.time()
+            cursor = conn.execute(
+                'UPDATE cache SET value = value + ? WHERE key = ? '
+                "AND typeof(value) IN ('integer', 'real') "
+                'AND (expires IS NULL OR expires > ?)',
+                (delta, key, now),
+            )
+            row = conn.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, now),
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            if not cursor.rowcount:
+                raise TypeError(f"Value of '{key}' is not a number")
+            return row[0]
+
+        return self._write(increment)
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._connection.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        names = [self._key(key, version) for key in keys]
+        if names:
+            self._connection.execute(
+                f'DELETE FROM cache WHERE key IN '
+                f'({", ".join("?" * len(names))})',
+                names,
+            )
+
+    def clear(self):
+        self._connection.execute('DELETE FROM cache')
+
+    def _maybe_cull(self):
+        self._writes += 1
+        if self._writes % CULL_EVERY:
+            return
+
+        def cull(conn):
+            conn.execute('DELETE FROM cache WHERE expires <= ?',
+                         (time.time(),))
+            count = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+            if count <= self._max_entries:
+                return
+            # как и встроенные бэкенды, удаляем долю записей за раз,
+            # но в порядке давности последнего чтения
+            victims = count
+            if self._cull_frequency:
+                victims //= self._cull_frequency
+            conn.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY accessed LIMIT ?)',
+                (victims,),
+            )
+
+        self._write(cull)
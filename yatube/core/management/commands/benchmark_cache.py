@@ -0,0 +1,89 @@
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+BACKENDS = (
+    ('LocMemCache', 'django.core.cache.backends.locmem.LocMemCache'),
+    ('FileBasedCache', 'django.core.cache.backends.filebased.FileBasedCache'),
+    ('SQLiteCache', 'core.cache.SQLiteCache'),
+)
+
+
+def run_worker(args):
+    """
+    Чтение со сквозной записью: ключ выбирается по закону Ципфа,
+    при промахе значение «рендерится» и кладётся в кеш.
+    """
+    path, location, params, ops, keys, size, seed = args
+    cache = import_string(path)(location, params)
+    rnd = random.Random(seed)
+    cum_weights = list(itertools.accumulate(
+        1 / rank for rank in range(1, keys + 1)))
+    value = 'x' * size
+    hits = 0
+    latencies = []
+    for key in rnd.choices(range(keys), cum_weights=cum_weights, k=ops):
+        started = time.perf_counter()
+        if cache.get(f'bench:{key}') is None:
+            cache.set(f'bench:{key}', value, None)
+        else:
+            hits += 1
+        latencies.append(time.perf_counter() - started)
+    return hits, latencies
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает долю попаданий и задержку кешей LocMem, '
+            'FileBased и SQLite при нагрузке из нескольких процессов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--ops', type=int, default=5000,
+                            help='Операций в каждом процессе.')
+        parser.add_argument('--keys', type=int, default=2000)
+        parser.add_argument('--value-size', type=int, default=2048,
+                            help='Размер значения в байтах, как у карточки.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        params = {'TIMEOUT': None,
+                  'OPTIONS': {'MAX_ENTRIES': options['keys'] * 2}}
+        for name, path in BACKENDS:
+            with tempfile.TemporaryDirectory() as directory:
+                location = {
+                    'LocMemCache': 'benchmark',
+                    'FileBasedCache': directory,
+                    'SQLiteCache': os.path.join(directory, 'cache.sqlite3'),
+                }[name]
+                jobs = [
+                    (path, location, params, options['ops'], options['keys'],
+                     options['value_size'], options['seed'] + number)
+                    for number in range(options['processes'])
+                ]
+                started = time.perf_counter()
+                with Pool(options['processes']) as pool:
+                    results = pool.map(run_worker, jobs)
+                elapsed = time.perf_counter() - started
+            self.report(name, results, elapsed)
+
+    def report(self, name, results, elapsed):
+        hits = sum(worker_hits for worker_hits, _ in results)
+        latencies = sorted(itertools.chain.from_iterable(
+            worker_latencies for _, worker_latencies in results))
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            '{}: попаданий {:.1%}, p50 {:.3f} мс, p95 {:.3f} мс, '
+            '{:.0f} оп/с'.format(
+                name,
+                hits / len(latencies),
+                statistics.median(latencies) * 1000,
+                p95 * 1000,
+                len(latencies) / elapsed,
+            ))
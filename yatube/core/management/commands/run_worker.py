@@ -0,0 +1,100 @@
+import logging
+import signal
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+from django.core.management.base import BaseCommand
+
+from core import tasks
+
+logger = logging.getLogger(__name__)
+
+# как часто возвращать брошенные задачи и чистить выполненные
+MAINTENANCE_EVERY = 60
+
+
+class Command(BaseCommand):
+    help = ('Выполняет задачи из очереди в базе в пуле потоков или '
+            'процессов; повторяет упавшие с растущей паузой.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--processes', action='store_true',
+                            help='Пул процессов вместо потоков: для '
+                                 'задач, которые нагружают процессор.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Пауза в секундах между опросами '
+                                 'пустой очереди.')
+        parser.add_argument('--once', action='store_true',
+                            help='Выйти, когда готовых задач не останется.')
+        parser.add_argument('--keep-days', type=int, default=7,
+                            help='Сколько дней хранить выполненные задачи.')
+
+    def stop(self, signum, frame):
+        # задачи, которые уже выполняются, доделываются
+        self.stopping = True
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        handlers = {signum: signal.signal(signum, self.stop)
+                    for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            done, failed = self.run(options)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(
+            f'Выполнено задач: {done}; с ошибкой: {failed}'))
+
+    def pool(self, options):
+        size = options['workers']
+        if options['processes']:
+            return ProcessPoolExecutor(max_workers=size,
+                                       initializer=tasks.init_worker)
+        return ThreadPoolExecutor(max_workers=size)
+
+    def maintain(self, options):
+        """Раз в MAINTENANCE_EVERY секунд чистит очередь."""
+        if time.monotonic() - self.maintained > MAINTENANCE_EVERY:
+            tasks.release_stale()
+            tasks.purge(options['keep_days'])
+            self.maintained = time.monotonic()
+
+    @staticmethod
+    def collect(finished):
+        """Сколько из завершённых задач выполнено и сколько упало."""
+        done = failed = 0
+        for future in finished:
+            try:
+                ok = future.result()
+            except Exception:
+                logger.exception('Воркер не смог выполнить задачу')
+                ok = False
+            done += ok
+            failed += not ok
+        return done, failed
+
+    def run(self, options):
+        worker = tasks.worker_name()
+        size = options['workers']
+        running = set()
+        done = failed = 0
+        self.maintained = 0
+        with self.pool(options) as pool:
+            while not self.stopping:
+                self.maintain(options)
+                for task in tasks.claim(worker, size - len(running)):
+                    running.add(pool.submit(tasks.execute, task.pk, worker))
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+                finished, running = wait(running, timeout=options['interval'],
+                                         return_when=FIRST_COMPLETED)
+                counts = self.collect(finished)
+                done += counts[0]
+                failed += counts[1]
+            counts = self.collect(wait(running).done)
+        return done + counts[0], failed + counts[1]
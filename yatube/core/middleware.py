@@ -0,0 +1,119 @@
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template.base import Node
+from django.utils.functional import empty
+
+logger = logging.getLogger('core.queries')
+
+# списки IN (%s, %s, ...) разной длины - один и тот же запрос
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def query_shape(sql):
+    return IN_LIST.sub('IN (...)', sql)
+
+
+def query_origin():
+    """
+    Откуда выполнен запрос: строка шаблона, если запрос сделан при
+    рендеринге, иначе ближайшая к запросу строка кода проекта.
+    """
+    frame = sys._getframe(2)
+    code_line = None
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        if isinstance(node, Node) and getattr(node, 'token', None):
+            return f'{node.origin.template_name}:{node.token.lineno}'
+        filename = frame.f_code.co_filename
+        if (code_line is None and filename.startswith(settings.BASE_DIR)
+                and 'site-packages' not in filename
+                and filename != __file__):
+            path = os.path.relpath(filename, settings.BASE_DIR)
+            code_line = f'{path}:{frame.f_lineno}'
+        frame = frame.f_back
+    return code_line or '?'
+
+
+class QueryRecorder:
+    """Обёртка execute_wrapper: считает запросы, время и повторы."""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.count = 0
+        self.duration = 0
+        self.shapes = Counter()
+        self.repeated = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = query_shape(sql)
+        self.shapes[shape] += 1
+        if self.shapes[shape] == self.threshold:
+            # стек разбирается только у подозрительных запросов
+            self.repeated[shape] = query_origin()
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class QueryInspectorMiddleware:
+    """
+    Считает запросы к базе и их время, пишет итог в журнал queries
+    и, при DEBUG или для сотрудников, в заголовок Server-Timing.
+    Запрос одной формы, повторённый QUERY_REPEAT_THRESHOLD раз,
+    считается N+1.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSPECTOR', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'QUERY_REPEAT_THRESHOLD', 3)
+
+    def __call__(self, request):
+        recorder = QueryRecorder(self.threshold)
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        if self.show_timing(request):
+            timing = [
+                f'db;dur={recorder.duration * 1000:.1f};'
+                f'desc="{recorder.count} queries"',
+                f'total;dur={total * 1000:.1f}',
+            ]
+            if recorder.repeated:
+                timing.append(
+                    f'nplusone;desc="{len(recorder.repeated)} shapes"')
+            response['Server-Timing'] = ', '.join(timing)
+
+        logger.info('%s %s %s: %d queries, db %.1f ms, total %.1f ms',
+                    request.method, request.path, response.status_code,
+                    recorder.count, recorder.duration * 1000, total * 1000)
+        for shape, origin in recorder.repeated.items():
+            logger.warning('N+1 on %s: %d x %s (%s)', request.path,
+                           recorder.shapes[shape], shape, origin)
+        return response
+
+    @staticmethod
+    def show_timing(request):
+        # запросы и их время раскрывают устройство сайта посторонним
+        if settings.DEBUG:
+            return True
+        user = getattr(request, 'user', None)
+        # ради заголовка сессия не загружается: вью, которые не читали
+        # пользователя, остаются без лишних запросов
+        if user is None or getattr(user, '_wrapped', None) is empty:
+            return False
+        return user.is_staff
@@ -0,0 +1,44 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """Задача фоновой очереди; её выполняет manage.py run_worker."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Не выполнена'),
+    )
+
+    name = models.CharField('Функция', max_length=200)
+    payload = models.TextField('Аргументы', default='{}')
+    priority = models.SmallIntegerField('Приоритет', default=0)
+    status = models.CharField('Состояние', max_length=10, choices=STATUSES,
+                              default=PENDING)
+    key = models.CharField('Ключ идемпотентности', max_length=200,
+                           unique=True, null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    max_attempts = models.PositiveSmallIntegerField('Попыток не больше',
+                                                    default=5)
+    run_at = models.DateTimeField('Не раньше', default=timezone.now)
+    locked_by = models.CharField('Воркер', max_length=100, blank=True)
+    locked_at = models.DateTimeField('Взята', null=True, blank=True)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    finished_at = models.DateTimeField('Завершена', null=True, blank=True)
+
+    class Meta:
+        # воркер выбирает задачи в порядке этого индекса без сортировки
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_at'],
+                         name='task_queue_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.name} [{self.status}]'
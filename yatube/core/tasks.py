@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import (IntegrityError, close_old_connections, connection,
+                       connections, transaction)
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# письма ждёт пользователь, обработка картинок может подождать
+HIGH = 10
+NORMAL = 0
+LOW = -10
+# статусы, при которых ключ задачи занят
+LIVE = (Task.PENDING, Task.RUNNING)
+
+
+def task_name(func):
+    if isinstance(func, str):
+        return func
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def is_eager():
+    """Выполнять задачи сразу, в процессе, который их поставил."""
+    eager = getattr(settings, 'TASKS_EAGER', None)
+    if eager is not None:
+        return eager
+    # воркер в другом процессе не увидит базу SQLite, открытую в памяти
+    return connection.vendor == 'sqlite' and connection.is_in_memory_db()
+
+
+def call(name, payload):
+    data = json.loads(payload)
+    return import_string(name)(*data['args'], **data['kwargs'])
+
+
+def call_eager(name, payload):
+    try:
+        call(name, payload)
+    except Exception:
+        logger.exception('Задача %s завершилась ошибкой', name)
+
+
+def enqueue(func, args=(), kwargs=None, priority=NORMAL, key=None,
+            delay=0, max_attempts=5):
+    """
+    Ставит вызов func(*args, **kwargs) в очередь и сразу возвращает задачу.
+
+    Аргументы должны сериализоваться в JSON. Воркер увидит задачу после
+    фиксации текущей транзакции. Задача с уже занятым ключом key не
+    создаётся: возвращается существующая. В режиме is_eager функция
+    вызывается после фиксации транзакции в этом же процессе.
+
+    Ключ занят, пока задача ждёт или выполняется: после выполнения
+    или окончательного сбоя он освобождается.
+    """
+    name = task_name(func)
+    payload = json.dumps({'args': list(args), 'kwargs': kwargs or {}})
+    task = Task(name=name, payload=payload, priority=priority, key=key,
+                max_attempts=max_attempts,
+                run_at=timezone.now() + timedelta(seconds=delay))
+    if is_eager():
+        transaction.on_commit(lambda: call_eager(name, payload))
+        return task
+    try:
+        with transaction.atomic():
+            task.save()
+    except IntegrityError:
+        if key is None:
+            raise
+        existing = Task.objects.filter(key=key).first()
+        if existing is not None and existing.status in LIVE:
+            return existing
+        # ключ держит завершённая задача, записанная до его освобождения
+        Task.objects.filter(key=key).exclude(status__in=LIVE).update(
+            key=None)
+        task.save()
+    return task
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def init_worker():
+    # соединения, унаследованные при fork, принадлежат родителю
+    connections.close_all()
+
+
+def claim(worker, limit=1):
+    """Забирает до limit готовых задач: сначала важные, затем старые."""
+    if limit < 1:
+        return []
+    now = timezone.now()
+    ids = list(Task.objects
+               .filter(status=Task.PENDING, run_at__lte=now)
+               .order_by('-priority', 'run_at')
+               .values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    # условие на статус отдаёт задачу только одному из воркеров,
+    # прочитавших её одновременно
+    Task.objects.filter(pk__in=ids, status=Task.PENDING).update(
+        status=Task.RUNNING, locked_by=worker, locked_at=now,
+        attempts=F('attempts') + 1)
+    return list(Task.objects
+                .filter(pk__in=ids, status=Task.RUNNING, locked_by=worker)
+                .order_by('-priority', 'run_at'))
+
+
+def backoff(attempts):
+    """Пауза перед следующей попыткой: экспонента со случайной частью."""
+    base = getattr(settings, 'TASK_RETRY_DELAY', 10)
+    limit = getattr(settings, 'TASK_RETRY_MAX_DELAY', 60 * 60)
+    delay = min(base * 2 ** max(attempts - 1, 0), limit)
+    # упавшие вместе задачи не возвращаются одной волной
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def execute(task_id, worker):
+    """
+    Выполняет взятую задачу. После ошибки задача ждёт следующей
+    попытки, а после последней помечается невыполненной.
+    """
+    close_old_connections()
+    try:
+        task = Task.objects.get(pk=task_id)
+        try:
+            call(task.name, task.payload)
+        except Exception:
+            logger.exception('Задача %s #%s завершилась ошибкой',
+                             task.name, task.pk)
+            fail(task, worker, traceback.format_exc())
+            return False
+        Task.objects.filter(pk=task.pk, locked_by=worker).update(
+            status=Task.DONE, finished_at=timezone.now(), last_error='',
+            key=None)
+        return True
+    finally:
+        close_old_connections()
+
+
+def fail(task, worker, error):
+    now = timezone.now()
+    changes = {'last_error': error, 'locked_by': '', 'locked_at': None}
+    if task.attempts >= task.max_attempts:
+        changes.update(status=Task.FAILED, finished_at=now, key=None)
+    else:
+        changes.update(status=Task.PENDING,
+                       run_at=now + timedelta(seconds=backoff(task.attempts)))
+    Task.objects.filter(pk=task.pk, locked_by=worker).update(**changes)
+
+
+def release_stale():
+    """
+    Возвращает в очередь задачи, которые воркер держит дольше
+    TASK_LEASE секунд: скорее всего, его процесс остановлен.
+    """
+    now = timezone.now()
+    deadline = now - timedelta(seconds=getattr(settings, 'TASK_LEASE',
+                                               10 * 60))
+    stale = Task.objects.filter(status=Task.RUNNING, locked_at__lt=deadline)
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.FAILED, finished_at=now, key=None,
+        last_error='Воркер не завершил задачу')
+    return stale.update(status=Task.PENDING, locked_by='', locked_at=None)
+
+
+def purge(days):
+    """Удаляет выполненные задачи старше days дней."""
+    deadline = timezone.now() - timedelta(days=days)
+    deleted, _ = Task.objects.filter(status=Task.DONE,
+                                     finished_at__lt=deadline).delete()
+    return deleted
+
+
+def send_email(subject, body, from_email, recipients, html_body=None):
+    """Задача отправки письма: SMTP не задерживает ответ вью."""
+    message = EmailMultiAlternatives(subject, body, from_email, recipients)
+    if html_body:
+        message.attach_alternative(html_body, 'text/html')
+    message.send()
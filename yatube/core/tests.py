@@ -0,0 +1,245 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from multiprocessing import Pool
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import reverse
+from django.utils import timezone
+
+from core import tasks
+from core.cache import CULL_EVERY, SQLiteCache
+from core.middleware import QueryInspectorMiddleware, query_shape
+from core.models import Task
+
+User = get_user_model()
+
+# вызовы задач из тестов очереди
+CALLS = []
+
+
+def increment(location):
+    cache = SQLiteCache(location, {})
+    for _ in range(50):
+        cache.incr('counter')
+
+
+def record(value):
+    CALLS.append(value)
+
+
+def explode():
+    raise RuntimeError('сбой')
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.location, {})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_add_get_delete(self):
+        """add не перезаписывает живой ключ, значения сериализуются."""
+        self.assertTrue(self.cache.add('key', {'a': 1}))
+        self.assertFalse(self.cache.add('key', 'другое'))
+        self.assertEqual(self.cache.get('key'), {'a': 1})
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_expired_key(self):
+        """Просроченный ключ не читается и может быть добавлен заново."""
+        self.cache.set('key', 'value', 0.01)
+        time.sleep(0.05)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 'new'))
+
+    def test_incr(self):
+        """incr работает с числами и отличает отсутствие ключа."""
+        self.cache.set('number', 1)
+        self.assertEqual(self.cache.incr('number', 5), 6)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.set('text', 'abc')
+        with self.assertRaises(TypeError):
+            self.cache.incr('text')
+
+    def test_incr_is_shared_between_processes(self):
+        """Процессы видят один кеш, и ни одно увеличение не теряется."""
+        self.cache.set('counter', 0)
+        with Pool(4) as pool:
+            pool.map(increment, [self.location] * 4)
+        self.assertEqual(self.cache.get('counter'), 200)
+
+    def test_cull_least_recently_used(self):
+        """При переполнении удаляются давно не читавшиеся записи."""
+        cache = SQLiteCache(self.location,
+                            {'OPTIONS': {'MAX_ENTRIES': CULL_EVERY - 10}})
+        cache.set('old', 'value')
+        cache._connection.execute(
+            "UPDATE cache SET accessed = 0 WHERE key = ':1:old'")
+        for number in range(CULL_EVERY):
+            cache.set(f'key-{number}', number)
+        self.assertIsNone(cache.get('old'))
+        self.assertEqual(cache.get(f'key-{CULL_EVERY - 1}'), CULL_EVERY - 1)
+
+
+class QueryInspectorTests(TestCase):
+    def inspect(self, view, user=None):
+        middleware = QueryInspectorMiddleware(view)
+        request = RequestFactory().get('/some/')
+        request.user = user or User(is_staff=True)
+        return middleware(request)
+
+    def test_server_timing(self):
+        """Число запросов попадает в заголовок Server-Timing."""
+        def view(request):
+            User.objects.count()
+            return HttpResponse()
+
+        response = self.inspect(view)
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertNotIn('nplusone', response['Server-Timing'])
+
+    def test_server_timing_hidden_from_visitors(self):
+        """Посетителям без DEBUG заголовок Server-Timing не отдаётся."""
+        response = self.inspect(lambda request: HttpResponse(),
+                                user=AnonymousUser())
+        self.assertNotIn('Server-Timing', response)
+
+    def test_repeated_queries_are_reported(self):
+        """Повторы запроса одной формы пишутся в журнал с местом вызова."""
+        def view(request):
+            for pk in range(5):
+                User.objects.filter(pk__in=range(pk + 1)).first()
+            return HttpResponse()
+
+        with self.assertLogs('core.queries', 'WARNING') as logs:
+            response = self.inspect(view)
+        self.assertIn('nplusone', response['Server-Timing'])
+        self.assertIn('5 x', logs.output[0])
+        self.assertIn('core/tests.py', logs.output[0])
+
+    def test_in_lists_share_shape(self):
+        self.assertEqual(query_shape('id IN (%s, %s)'),
+                         query_shape('id IN (%s)'))
+
+
+@override_settings(TASKS_EAGER=False)
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_idempotency_key(self):
+        """Задача с занятым ключом не создаётся второй раз."""
+        first = tasks.enqueue(record, args=[1], key='once')
+        second = tasks.enqueue(record, args=[2], key='once')
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test_key_released_after_finish(self):
+        """После выполнения задачи её ключ можно занять снова."""
+        first = tasks.enqueue(record, args=[1], key='again')
+        tasks.execute(tasks.claim('test')[0].pk, 'test')
+        second = tasks.enqueue(record, args=[2], key='again')
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertEqual(Task.objects.filter(status=Task.PENDING).count(), 1)
+        # ключ, оставшийся у завершённой задачи, тоже не мешает
+        Task.objects.filter(pk=second.pk).update(status=Task.FAILED)
+        third = tasks.enqueue(record, args=[3], key='again')
+        self.assertNotEqual(third.pk, second.pk)
+        self.assertEqual(Task.objects.get(key='again').pk, third.pk)
+
+    def test_claim_by_priority(self):
+        """Воркер берёт сначала важные задачи, отложенные не берёт."""
+        low = tasks.enqueue(record, args=['low'], priority=tasks.LOW)
+        high = tasks.enqueue(record, args=['high'], priority=tasks.HIGH)
+        tasks.enqueue(record, args=['later'], priority=tasks.HIGH, delay=60)
+        claimed = tasks.claim('test', limit=5)
+        self.assertEqual([task.pk for task in claimed], [high.pk, low.pk])
+        self.assertEqual(tasks.claim('other', limit=5), [])
+        for task in claimed:
+            self.assertTrue(tasks.execute(task.pk, 'test'))
+        self.assertEqual(CALLS, ['high', 'low'])
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 2)
+
+    def test_retry_with_backoff(self):
+        """Упавшая задача откладывается, после последней попытки - сбой."""
+        task = tasks.enqueue(explode, max_attempts=2)
+        with self.assertLogs('core.tasks', 'ERROR'):
+            tasks.execute(tasks.claim('test')[0].pk, 'test')
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.PENDING)
+        self.assertEqual(task.attempts, 1)
+        self.assertGreater(task.run_at, timezone.now())
+        self.assertIn('RuntimeError', task.last_error)
+
+        Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+        with self.assertLogs('core.tasks', 'ERROR'):
+            tasks.execute(tasks.claim('test')[0].pk, 'test')
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.FAILED)
+        self.assertEqual(task.attempts, 2)
+
+    def test_backoff_grows(self):
+        """Пауза растёт вдвое с каждой попыткой и ограничена сверху."""
+        for attempts in range(1, 5):
+            delay = 10 * 2 ** (attempts - 1)
+            self.assertGreaterEqual(tasks.backoff(attempts), delay / 2)
+            self.assertLessEqual(tasks.backoff(attempts), delay)
+        self.assertLessEqual(tasks.backoff(100), 60 * 60)
+
+    def test_release_stale(self):
+        """Задача остановленного воркера возвращается в очередь."""
+        task = tasks.enqueue(record, args=[1])
+        tasks.claim('gone')
+        Task.objects.filter(pk=task.pk).update(
+            locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(tasks.release_stale(), 1)
+        self.assertEqual(tasks.claim('test')[0].pk, task.pk)
+
+    def test_password_reset_mail_is_queued(self):
+        """Письмо сброса пароля уходит из воркера, а не из вью."""
+        User.objects.create_user(username='reset', email='reset@yatube.ru',
+                                 password='pass')
+        response = self.client.post(reverse('users:password_reset_form'),
+                                    {'email': 'reset@yatube.ru'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        task = Task.objects.get()
+        self.assertEqual(task.priority, tasks.HIGH)
+        # ссылка с токеном не хранится в очереди
+        self.assertNotIn('/reset/', task.payload)
+        tasks.execute(tasks.claim('test')[0].pk, 'test')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['reset@yatube.ru'])
+        self.assertIn('/reset/', mail.outbox[0].body)
+
+
+@override_settings(TASKS_EAGER=False)
+class RunWorkerTests(TransactionTestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_run_once(self):
+        """run_worker --once выполняет готовые задачи в пуле и выходит."""
+        for number in range(6):
+            tasks.enqueue(record, args=[number])
+        tasks.enqueue(explode, max_attempts=1)
+        with self.assertLogs('core.tasks', 'ERROR'):
+            call_command('run_worker', '--once', '--workers', '2',
+                         '--interval', '0.05', stdout=io.StringIO())
+        self.assertEqual(sorted(CALLS), list(range(6)))
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 6)
+        self.assertEqual(Task.objects.filter(status=Task.FAILED).count(), 1)
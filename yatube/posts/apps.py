@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import signals
+
+        # пересоздание таблицы posts_post в миграциях SQLite
+        # удаляет триггеры полнотекстового индекса
+        post_migrate.connect(signals.install_search, sender=self)
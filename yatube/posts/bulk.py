@@ -0,0 +1,102 @@
+from contextlib import contextmanager
+
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import suggestions, timeline
+from .models import Comment, Post
+
+# поля, которые Django заполняет сам и не даёт перенести из источника
+DATE_FIELDS = (
+    (Post, 'pub_date'),
+    (Post, 'updated_at'),
+    (Comment, 'created'),
+)
+
+
+@contextmanager
+def keep_dates():
+    """Отключает auto_now и auto_now_add, чтобы сохранить даты как есть."""
+    fields = [model._meta.get_field(name) for model, name in DATE_FIELDS]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def insert_rows(model, fields, rows):
+    """
+    Вставляет готовые для базы значения одним executemany: без
+    экземпляров моделей и компиляции каждого поля, как в bulk_create.
+    Сигналы не вызываются, auto_now не срабатывает.
+    """
+    quote = connection.ops.quote_name
+    columns = [model._meta.get_field(name).column for name in fields]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table),
+        ', '.join(map(quote, columns)),
+        ', '.join(['%s'] * len(columns)),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def lock_table(model):
+    """
+    Не даёт другим соединениям писать в таблицу до конца транзакции:
+    id, выданные после MAX(id), не займёт сайт.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE')
+        else:
+            # пустое удаление открывает в SQLite пишущую транзакцию
+            cursor.execute(f'DELETE FROM {table} WHERE 1 = 0')
+
+
+def reset_sequence(model):
+    """Сдвигает последовательность id за вставленные вручную строки."""
+    statements = connection.ops.sequence_reset_sql(no_style(), [model])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def refresh_derived(stdout=None, posts=None, users=None, follows=True):
+    """
+    Пересчитывает то, что при обычном сохранении поддерживают сигналы:
+    счётчики комментариев, UserStats, материализованные ленты и
+    предложения авторов.
+
+    posts - queryset изменившихся постов, users - id пользователей,
+    чьи посты или подписки изменились; без них пересчитывается всё.
+    follows=False пропускает предложения: они зависят только от
+    подписок.
+    """
+    if posts is None:
+        posts = Post.objects.all()
+    posts.update(comments_count=Coalesce(Subquery(
+        Comment.objects.filter(post=OuterRef('pk'))
+        .order_by()
+        .values('post')
+        .annotate(total=Count('pk'))
+        .values('total')
+    ), 0))
+    if users is None:
+        call_command('rebuild_user_stats', stdout=stdout)
+        timeline.rebuild()
+    elif users:
+        call_command('rebuild_user_stats', users=list(users),
+                     stdout=stdout)
+        # новые подписки и посты касаются только этих авторов
+        timeline.fill(users)
+    if follows:
+        suggestions.rebuild()
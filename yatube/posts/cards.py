@@ -0,0 +1,104 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from . import thumbnails
+
+TEMPLATE = 'posts/includes/post_card.html'
+# версия в ключе делает старые карточки недостижимыми, поэтому
+# их можно хранить долго: вытеснит сам кеш
+TIMEOUT = 60 * 60 * 24
+
+
+def timeout():
+    return getattr(settings, 'POST_CARD_TIMEOUT', TIMEOUT)
+
+
+def post_version_key(post_id):
+    return f'post-card-version:{post_id}'
+
+
+def group_version_key(group_id):
+    return f'group-card-version:{group_id}'
+
+
+def fresh_version():
+    # если счётчик вытеснен из кеша, новая версия не должна совпасть
+    # ни с одной из прежних, иначе вернутся устаревшие карточки
+    return time.time_ns()
+
+
+def bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, fresh_version(), None)
+
+
+def bump_post(post_id):
+    bump(post_version_key(post_id))
+
+
+def bump_group(group_id):
+    bump(group_version_key(group_id))
+
+
+def card_keys(posts):
+    """
+    Ключи карточек: id поста и версии поста и его группы.
+    Версии всех постов страницы читаются из кеша одним запросом.
+    """
+    keys = set()
+    for post in posts:
+        keys.add(post_version_key(post.pk))
+        if post.group_id:
+            keys.add(group_version_key(post.group_id))
+    versions = cache.get_many(list(keys))
+    for key in keys - versions.keys():
+        version = fresh_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+        versions[key] = version
+    result = []
+    for post in posts:
+        parts = [versions[post_version_key(post.pk)]]
+        if post.group_id:
+            parts.append(versions[group_version_key(post.group_id)])
+        result.append('post-card:{}:{}'.format(
+            post.pk, ':'.join(map(str, parts))))
+    return result
+
+
+def card_key(post):
+    return card_keys([post])[0]
+
+
+def render_many(posts):
+    """
+    HTML карточек постов страницы: из кеша или заново. Для карточек,
+    которых нет в кеше, миниатюры ищутся сразу для всех картинок.
+
+    Карточку с заглушкой вместо картинки не кешируем: миниатюры
+    появятся позже без смены версии поста.
+    """
+    posts = list(posts)
+    keys = card_keys(posts)
+    cards = cache.get_many(keys)
+    missing = [(key, post) for key, post in zip(keys, posts)
+               if key not in cards]
+    variants = thumbnails.cached_variants_many(
+        post.image for _, post in missing)
+    rendered = {}
+    for key, post in missing:
+        html = render_to_string(TEMPLATE, {
+            'post': post,
+            'variants': variants.get(post.image.name, {}),
+        })
+        cards[key] = html
+        if not (post.image and 'thumbnail-placeholder' in html):
+            rendered[key] = html
+    if rendered:
+        cache.set_many(rendered, timeout())
+    return [cards[key] for key in keys]
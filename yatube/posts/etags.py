@@ -0,0 +1,163 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.views.decorators.http import condition
+
+from . import follows
+from .models import Group, Post
+
+User = get_user_model()
+
+ALL = 'all'
+# названия и адреса групп видны в карточках любой ленты
+GROUPS = 'groups'
+# все предложения «кого почитать» после ночного пересчёта
+SUGGESTIONS = 'suggestions'
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def author_scope(author_id):
+    return f'author:{author_id}'
+
+
+def follower_scope(user_id):
+    return f'follower:{user_id}'
+
+
+def suggestion_scope(user_id):
+    return f'suggestions:{user_id}'
+
+
+def scope_key(scope):
+    return f'feed-changed:{scope}'
+
+
+def touch(*scopes):
+    """Отмечает ленты изменившимися; отметка - время изменения."""
+    now = time.time()
+    cache.set_many({scope_key(scope): now for scope in scopes if scope},
+                   None)
+
+
+def post_scopes(author_id, group_id):
+    return (ALL, author_scope(author_id),
+            group_scope(group_id) if group_id else None)
+
+
+def touch_posts(posts):
+    """Отмечает все ленты, в которых показаны посты из queryset."""
+    for author_id, group_id in (posts.order_by()
+                                .values_list('author_id', 'group_id')
+                                .distinct()):
+        touch(*post_scopes(author_id, group_id))
+
+
+def changed_at(*scopes):
+    """
+    Время последнего изменения лент.
+
+    Если отметка вытеснена из кеша, лента считается изменённой сейчас:
+    лишний ответ 200 лучше ошибочного 304.
+    """
+    keys = [scope_key(scope) for scope in scopes]
+    stamps = cache.get_many(keys)
+    for key in keys:
+        if key not in stamps:
+            now = time.time()
+            if not cache.add(key, now, None):
+                now = cache.get(key, now)
+            stamps[key] = now
+    return max(stamps.values())
+
+
+def index_state(request):
+    return changed_at(ALL, GROUPS), ()
+
+
+def group_state(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True).first()
+    if group_id is None:
+        return None
+    return changed_at(group_scope(group_id), GROUPS), ()
+
+
+def profile_state(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    if author_id is None:
+        return None
+    return changed_at(author_scope(author_id), GROUPS), ()
+
+
+def profile_page_state(request, username):
+    """Страница профиля: ещё и предложения «кого почитать» зрителю."""
+    found = profile_state(request, username)
+    if found is None or not request.user.is_authenticated:
+        return found
+    stamp, parts = found
+    return max(stamp, changed_at(SUGGESTIONS,
+                                 suggestion_scope(request.user.pk))), parts
+
+
+def follow_state(request):
+    if not request.user.is_authenticated:
+        return None
+    authors = follows.followed_ids(request.user.pk)
+    return changed_at(follower_scope(request.user.pk), GROUPS,
+                      *map(author_scope, authors)), ()
+
+
+def post_state(request, post_id):
+    found = Post.objects.filter(pk=post_id).values_list(
+        'updated_at', 'author_id').first()
+    if found is None:
+        return None
+    updated_at, author_id = found
+    # на странице поста есть число постов автора
+    return (max(updated_at.timestamp(),
+                changed_at(author_scope(author_id), GROUPS)),
+            (post_id,))
+
+
+def conditional(state, per_user=True):
+    """
+    Декоратор условного GET: state(request, **kwargs) возвращает время
+    изменения и дополнительные части ETag или None, если страницы нет.
+    Шаблон при совпадении ETag или Last-Modified не рендерится.
+    Для ответов, одинаковых для всех, per_user=False: ETag не читает
+    request.user, и сессия не загружается. Страницы, зависящие от
+    пользователя, отдают только ETag: Last-Modified одинаков для всех,
+    и по If-Modified-Since можно получить 304 на чужую страницу.
+    """
+    def cached_state(request, *args, **kwargs):
+        if not hasattr(request, '_conditional_state'):
+            request._conditional_state = state(request, *args, **kwargs)
+        return request._conditional_state
+
+    def etag(request, *args, **kwargs):
+        found = cached_state(request, *args, **kwargs)
+        if found is None:
+            return None
+        stamp, parts = found
+        # страница зависит от пользователя (шапка, кнопки) и параметров
+        user_pk = request.user.pk if per_user else None
+        raw = '|'.join(map(str, (
+            repr(stamp), *parts, user_pk or '', request.get_full_path(),
+        )))
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        found = cached_state(request, *args, **kwargs)
+        if found is None:
+            return None
+        return datetime.fromtimestamp(found[0], timezone.utc)
+
+    return condition(etag_func=etag,
+                     last_modified_func=None if per_user else last_modified)
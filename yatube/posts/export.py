@@ -0,0 +1,156 @@
+import base64
+import binascii
+import csv
+import json
+from datetime import datetime
+
+from django.contrib.auth import get_user_model
+
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# строк, которые драйвер базы читает за раз; память не растёт
+# с числом постов
+CHUNK_SIZE = 2000
+
+# поле записи и путь к нему в values_list
+FIELDS = {
+    'user': (
+        ('id', 'id'), ('username', 'username'),
+        ('first_name', 'first_name'), ('last_name', 'last_name'),
+        ('email', 'email'), ('password', 'password'),
+        ('date_joined', 'date_joined'), ('is_active', 'is_active'),
+        ('is_staff', 'is_staff'), ('is_superuser', 'is_superuser'),
+    ),
+    'group': (
+        ('id', 'id'), ('title', 'title'), ('slug', 'slug'),
+        ('description', 'description'),
+    ),
+    'post': (
+        ('id', 'id'), ('author', 'author__username'),
+        ('group', 'group__slug'), ('pub_date', 'pub_date'),
+        ('updated_at', 'updated_at'), ('image', 'image'), ('text', 'text'),
+    ),
+    'comment': (
+        ('id', 'id'), ('post', 'post_id'), ('author', 'author__username'),
+        ('created', 'created'), ('text', 'text'),
+    ),
+    'follow': (
+        ('id', 'id'), ('user', 'user__username'),
+        ('author', 'author__username'),
+    ),
+}
+
+
+def encode_cursor(kind, pk):
+    """Позиция выгрузки: тип последней записи и её id."""
+    raw = f'{kind}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Распаковывает позицию; для битого токена возвращает None."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        kind, pk = raw.decode().split('|')
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if kind not in FIELDS:
+        return None
+    return kind, pk
+
+
+def profile_sections(author):
+    """Посты и комментарии автора."""
+    return [
+        ('post', Post.objects.filter(author=author)),
+        ('comment', Comment.objects.filter(author=author)),
+    ]
+
+
+def site_sections():
+    """Весь сайт в порядке, в котором записи можно загрузить обратно."""
+    return [
+        ('user', User.objects.all()),
+        ('group', Group.objects.all()),
+        ('post', Post.objects.all()),
+        ('comment', Comment.objects.all()),
+        ('follow', Follow.objects.all()),
+    ]
+
+
+def records(sections, position=None):
+    """
+    Записи разделов по возрастанию id. С позицией из decode_cursor
+    выгрузка продолжается со следующей после неё записи.
+    """
+    kinds = [kind for kind, _ in sections]
+    start, after = 0, 0
+    if position is not None:
+        kind, after = position
+        start = kinds.index(kind) if kind in kinds else len(kinds)
+    for number, (kind, queryset) in enumerate(sections):
+        if number < start:
+            continue
+        names, lookups = zip(*FIELDS[kind])
+        rows = (queryset.filter(pk__gt=after if number == start else 0)
+                .order_by('pk')
+                .values_list(*lookups)
+                .iterator(chunk_size=CHUNK_SIZE))
+        for values in rows:
+            record = {'type': kind, **dict(zip(names, values))}
+            record['cursor'] = encode_cursor(kind, record['id'])
+            yield record
+
+
+def columns(sections):
+    """Столбцы CSV: объединение полей всех разделов."""
+    names = ['type']
+    for kind, _ in sections:
+        names.extend(name for name, _ in FIELDS[kind] if name not in names)
+    names.append('cursor')
+    return names
+
+
+def plain(value):
+    # isoformat вместо DjangoJSONEncoder: тот отбрасывает микросекунды
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def ndjson_lines(items):
+    for record in items:
+        yield json.dumps({key: plain(value) for key, value in record.items()},
+                         ensure_ascii=False) + '\n'
+
+
+class Echo:
+    """Файл для csv.writer, который возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(items, names):
+    writer = csv.DictWriter(Echo(), names)
+    yield writer.writerow(dict(zip(names, names)))
+    for record in items:
+        yield writer.writerow({key: plain(value)
+                               for key, value in record.items()})
+
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def lines(sections, format_, position=None):
+    """Строки выгрузки в формате ndjson или csv."""
+    items = records(sections, position)
+    if format_ == 'csv':
+        return csv_lines(items, columns(sections))
+    return ndjson_lines(items)
@@ -0,0 +1,188 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.http import http_date
+
+from . import etags
+from .models import Group, Post
+
+User = get_user_model()
+
+ITEMS = 20
+# только то, что попадает в ленту
+ITEM_FIELDS = ('text', 'pub_date', 'author__username',
+               'author__first_name', 'author__last_name')
+
+
+def timeout():
+    return getattr(settings, 'FEED_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+class SiteFeed(Feed):
+    title = 'Yatube: последние записи'
+    description = 'Новые посты всех авторов'
+
+    def link(self):
+        return reverse('posts:index')
+
+    def posts(self, obj):
+        return Post.objects.all()
+
+    def items(self, obj):
+        return (self.posts(obj).select_related('author')
+                .only('pk', *ITEM_FIELDS)[:ITEMS])
+
+    def item_title(self, item):
+        return item.text[:50]
+
+    def item_description(self, item):
+        return item.text
+
+    def item_link(self, item):
+        return reverse('posts:post_detail', kwargs={'post_id': item.pk})
+
+    def item_pubdate(self, item):
+        return item.pub_date
+
+    def item_author_name(self, item):
+        return item.author.get_full_name() or item.author.username
+
+
+class GroupFeed(SiteFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Group, slug=slug)
+
+    def title(self, obj):
+        return f'Yatube: {obj.title}'
+
+    def description(self, obj):
+        return obj.description
+
+    def link(self, obj):
+        return reverse('posts:group_list', kwargs={'slug': obj.slug})
+
+    def posts(self, obj):
+        return Post.objects.filter(group=obj)
+
+
+class AuthorFeed(SiteFeed):
+    def get_object(self, request, username):
+        return get_object_or_404(User, username=username)
+
+    def title(self, obj):
+        return f'Yatube: {obj.get_full_name() or obj.username}'
+
+    def description(self, obj):
+        return f'Посты автора {obj.username}'
+
+    def link(self, obj):
+        return reverse('posts:profile', kwargs={'username': obj.username})
+
+    def posts(self, obj):
+        return Post.objects.filter(author=obj)
+
+
+class SiteAtomFeed(SiteFeed):
+    feed_type = Atom1Feed
+    subtitle = SiteFeed.description
+
+
+class GroupAtomFeed(GroupFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj):
+        return self.description(obj)
+
+
+class AuthorAtomFeed(AuthorFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj):
+        return self.description(obj)
+
+
+def site_scopes():
+    return (etags.ALL,)
+
+
+def group_scopes(slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True).first()
+    if group_id is None:
+        raise Http404
+    # заголовок и описание ленты берутся из группы
+    return etags.group_scope(group_id), etags.GROUPS
+
+
+def author_scopes(username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    if author_id is None:
+        raise Http404
+    return (etags.author_scope(author_id),)
+
+
+def cached_feed(feed_class, scopes):
+    """
+    Вью ленты с кешем, который сбрасывается сменой отметок etags.
+
+    В кеше лежат тело ленты, отметка, с которой оно построено, и
+    ключи отметок: они не меняются, пока жива группа или автор, поэтому
+    запрос к базе не нужен. Ссылки в ленте абсолютные, поэтому ключ
+    тела включает схему и хост запроса. Last-Modified и
+    ETag берутся из отметки, поэтому If-Modified-Since и
+    If-None-Match отвечаются без рендеринга.
+    """
+    feed = feed_class()
+
+    def view(request, **kwargs):
+        url = request.build_absolute_uri(request.path)
+        body_key = 'feed:' + hashlib.md5(url.encode()).hexdigest()
+        entry = cache.get(body_key)
+        stamp = None
+        if entry is not None:
+            found = cache.get_many(entry['keys'])
+            if all(key in found for key in entry['keys']):
+                stamp = max(found.values())
+        if entry is None or stamp is None or entry['stamp'] != stamp:
+            feed_scopes = scopes(**kwargs)
+            keys = [etags.scope_key(scope) for scope in feed_scopes]
+            stamp = etags.changed_at(*feed_scopes)
+            response = feed(request, **kwargs)
+            entry = {
+                'keys': keys,
+                'stamp': stamp,
+                'content_type': response['Content-Type'],
+                'body': response.content,
+            }
+            cache.set(body_key, entry, timeout())
+
+        etag = '"{}"'.format(hashlib.md5(
+            f'{stamp!r}|{url}'.encode()).hexdigest())
+        last_modified = int(stamp)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = HttpResponse(entry['body'],
+                                    content_type=entry['content_type'])
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    return view
+
+
+site_rss = cached_feed(SiteFeed, site_scopes)
+site_atom = cached_feed(SiteAtomFeed, site_scopes)
+group_rss = cached_feed(GroupFeed, group_scopes)
+group_atom = cached_feed(GroupAtomFeed, group_scopes)
+author_rss = cached_feed(AuthorFeed, author_scopes)
+author_atom = cached_feed(AuthorAtomFeed, author_scopes)
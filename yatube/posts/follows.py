@@ -0,0 +1,68 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Follow
+
+# 4 байта на автора: подписки на десятки тысяч авторов занимают
+# в кеше сотни килобайт, а не мегабайты словаря
+TYPECODE = 'i'
+# больше id не передаём параметрами IN: столько параметров
+# поддерживает любая сборка SQLite
+IN_LIMIT = 900
+
+
+def timeout():
+    return getattr(settings, 'FOLLOW_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def followed_key(user_id):
+    return f'followed:{user_id}'
+
+
+def followed_ids(user_id):
+    """
+    id авторов, на которых подписан пользователь, по возрастанию.
+
+    Хранятся в кеше упакованным массивом int и сбрасываются forget
+    при подписке и отписке.
+    """
+    packed = cache.get(followed_key(user_id))
+    ids = array(TYPECODE)
+    if packed is None:
+        ids.extend(Follow.objects.filter(user_id=user_id)
+                   .order_by('author_id')
+                   .values_list('author_id', flat=True))
+        cache.set(followed_key(user_id), ids.tobytes(), timeout())
+    else:
+        ids.frombytes(packed)
+    return ids
+
+
+def is_following(user_id, author_id):
+    """Подписан ли пользователь на автора: двоичный поиск без запроса."""
+    ids = followed_ids(user_id)
+    position = bisect_left(ids, author_id)
+    return position < len(ids) and ids[position] == author_id
+
+
+def authors_filter(user_id):
+    """
+    Значение для author_id__in: список id или, для очень больших
+    подписок, подзапрос к таблице подписок.
+    """
+    ids = followed_ids(user_id)
+    if len(ids) > IN_LIMIT:
+        return Follow.objects.filter(user_id=user_id).values('author_id')
+    return list(ids)
+
+
+def forget(*user_ids):
+    """Сбрасывает подписки пользователей в кеше."""
+    keys = [followed_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # читатель мог успеть положить в кеш старый набор до фиксации
+    transaction.on_commit(lambda: cache.delete_many(keys))
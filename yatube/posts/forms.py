@@ -1,4 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+
+from . import images
 from .models import Post, Comment
 
 
@@ -17,6 +20,13 @@ class PostForm(forms.ModelForm):
                 'Кажется, все-таки нужно что-нибудь написать.')
         return data
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # уже сохранённая картинка поста приходит как FieldFile
+        if isinstance(image, UploadedFile):
+            image = images.normalize(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
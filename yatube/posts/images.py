@@ -0,0 +1,87 @@
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+
+# что принимаем на вход; сохраняется всегда JPEG или PNG
+FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP', 'BMP', 'TIFF')
+
+
+def max_edge():
+    return getattr(settings, 'IMAGE_MAX_EDGE', 2048)
+
+
+def open_checked(file_):
+    """
+    Открывает загрузку, прочитав только заголовок: формат и размеры
+    известны до декодирования, поэтому огромная картинка отсекается,
+    не заняв память.
+    """
+    file_.seek(0)
+    try:
+        image = Image.open(file_)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError('Файл не похож на картинку.')
+    if image.format not in FORMATS:
+        raise ValidationError(f'Формат {image.format} не поддерживается.')
+    width, height = image.size
+    limit = getattr(settings, 'IMAGE_MAX_PIXELS', 40 * 1000 * 1000)
+    if width * height > limit:
+        raise ValidationError(
+            f'Слишком большая картинка: {width}x{height} точек.')
+    return image
+
+
+def is_opaque(image):
+    if image.mode not in ('RGBA', 'LA', 'PA'):
+        return True
+    return image.getchannel('A').getextrema()[0] == 255
+
+
+def normalize(file_):
+    """
+    Готовит загрузку к хранению: поворот из EXIF применяется к точкам,
+    метаданные отбрасываются, длинная сторона ужимается до
+    IMAGE_MAX_EDGE, а картинка пересжимается в JPEG с качеством
+    IMAGE_QUALITY или, если в ней есть прозрачность, в PNG. Анимация
+    сохраняется как есть.
+    """
+    image = open_checked(file_)
+    if getattr(image, 'is_animated', False):
+        file_.seek(0)
+        return file_
+    edge = max_edge()
+    width, height = image.size
+    scale = min(edge / max(width, height), 1)
+    # JPEG декодируется сразу в 1/2, 1/4 или 1/8 размера, но не
+    # меньше итогового: 12 мегапикселей не распаковываются целиком
+    image.draft('RGB', (round(width * scale), round(height * scale)))
+    try:
+        image = ImageOps.exif_transpose(image)
+        if image.mode == 'P':
+            image = image.convert('RGBA')
+        if is_opaque(image):
+            image = image.convert('RGB')
+            format_, extension = 'JPEG', 'jpg'
+            options = {'quality': getattr(settings, 'IMAGE_QUALITY', 85),
+                       'optimize': True, 'progressive': True}
+        else:
+            image = image.convert('RGBA')
+            format_, extension = 'PNG', 'png'
+            options = {'optimize': True}
+    except (OSError, ValueError):
+        raise ValidationError('Картинку не удалось прочитать.')
+    image.thumbnail((edge, edge), Image.LANCZOS)
+
+    # EXIF, XMP и комментарии не переносятся; цветовой профиль
+    # остаётся, иначе снимки с широким охватом поблёкнут
+    options['icc_profile'] = image.info.get('icc_profile')
+    image.info = {}
+    buffer = BytesIO()
+    image.save(buffer, format_, **options)
+    stem = os.path.splitext(os.path.basename(file_.name))[0] or 'image'
+    return ContentFile(buffer.getvalue(), name=f'{stem}.{extension}')
@@ -0,0 +1,106 @@
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import string
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+BATCH_SIZE = 10000
+VOCABULARY_SIZE = 20000
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает поиск через FTS5 и через LIKE на синтетическом '
+            'корпусе постов в отдельной временной базе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--words', type=int, default=30,
+                            help='Слов в одном посте.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        vocabulary = [
+            ''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(3, 10)))
+            for _ in range(VOCABULARY_SIZE)
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            db = sqlite3.connect(os.path.join(directory, 'bench.sqlite3'))
+            self.seed(db, rnd, vocabulary, options['posts'], options['words'])
+            queries = [
+                ' '.join(rnd.choices(vocabulary[:2000], k=rnd.randint(1, 2)))
+                for _ in range(options['queries'])
+            ]
+            fts = self.measure(db, queries, self.fts_query)
+            like = self.measure(db, queries, self.like_query)
+            db.close()
+        self.report('FTS5', fts)
+        self.report('LIKE', like)
+        if statistics.median(fts):
+            self.stdout.write('Ускорение по медиане: {:.1f}x'.format(
+                statistics.median(like) / statistics.median(fts)))
+
+    def seed(self, db, rnd, vocabulary, posts, words):
+        started = time.perf_counter()
+        db.execute('CREATE TABLE posts_post '
+                   '(id INTEGER PRIMARY KEY, text TEXT NOT NULL)')
+        # распределение слов близко к закону Ципфа, как в живых текстах
+        cum_weights = list(itertools.accumulate(
+            1 / rank for rank in range(1, len(vocabulary) + 1)))
+        for start in range(0, posts, BATCH_SIZE):
+            rows = [
+                (' '.join(rnd.choices(vocabulary, cum_weights=cum_weights,
+                                      k=words)),)
+                for _ in range(min(BATCH_SIZE, posts - start))
+            ]
+            db.executemany('INSERT INTO posts_post (text) VALUES (?)', rows)
+        db.execute(search.CREATE_TABLE)
+        db.execute(f"INSERT INTO {search.FTS_TABLE}({search.FTS_TABLE}) "
+                   "VALUES ('rebuild')")
+        db.commit()
+        self.stdout.write('Корпус из {} постов готов за {:.1f} с'.format(
+            posts, time.perf_counter() - started))
+
+    @staticmethod
+    def fts_query(db, query):
+        return db.execute(
+            search.SEARCH_SQL.replace('%s', '?'),
+            [search.match_expression(query), float('-inf'), float('-inf'),
+             0, 11],
+        ).fetchall()
+
+    @staticmethod
+    def like_query(db, query):
+        sql = 'SELECT id, text FROM posts_post WHERE '
+        words = query.split()
+        sql += ' AND '.join('text LIKE ?' for _ in words)
+        sql += ' ORDER BY id DESC LIMIT 11'
+        return db.execute(sql, [f'%{word}%' for word in words]).fetchall()
+
+    @staticmethod
+    def measure(db, queries, run):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            run(db, query)
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    def report(self, name, timings):
+        timings = sorted(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            '{}: p50 {:.2f} мс, p95 {:.2f} мс, среднее {:.2f} мс'.format(
+                name,
+                statistics.median(timings) * 1000,
+                p95 * 1000,
+                statistics.mean(timings) * 1000,
+            ))
@@ -0,0 +1,366 @@
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import string
+import tempfile
+import time
+from datetime import timedelta
+
+import django
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.middleware.csrf import get_token
+from django.http import HttpRequest
+from django.test import Client, RequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from api import urls as api_urls
+from posts import bulk, thumbnails
+from posts import urls as posts_urls
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# строк в одном списке для bulk_create; размер INSERT Django
+# подбирает сам под ограничения SQLite
+BATCH_SIZE = 5000
+VOCABULARY_SIZE = 5000
+IMAGE_POOL = 20
+DATASETS = {
+    '10k': {'posts': 10000, 'users': 500, 'groups': 20},
+    '100k': {'posts': 100000, 'users': 5000, 'groups': 50},
+    '1m': {'posts': 1000000, 'users': 20000, 'groups': 200},
+}
+# маршруты, меняющие данные через POST
+POST_ROUTES = {'add_comment': {'text': 'Комментарий из бенчмарка'}}
+
+
+def zipf_weights(count):
+    """Накопленные веса: немногие авторы пишут и читаются больше всех."""
+    return list(itertools.accumulate(1 / rank
+                                     for rank in range(1, count + 1)))
+
+
+def percentile(timings, share):
+    return timings[min(len(timings) - 1, int(len(timings) * share))]
+
+
+class Command(BaseCommand):
+    help = ('Заполняет отдельную базу синтетическими данными и замеряет '
+            'маршруты posts и api через WSGI-обработчик; итог пишется в JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices=DATASETS, default='10k')
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Подписок у пользователя в среднем.')
+        parser.add_argument('--comments', type=float, default=2,
+                            help='Комментариев на пост в среднем.')
+        parser.add_argument('--images', type=float, default=0.2,
+                            help='Доля постов с картинкой.')
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--database', default=None,
+                            help='Файл базы, который сохраняется между '
+                                 'запусками; без него база временная.')
+        parser.add_argument('--output', default=None)
+
+    def handle(self, *args, **options):
+        dataset = options['dataset']
+        self.options = options
+        self.rnd = random.Random(options['seed'])
+        with tempfile.TemporaryDirectory() as directory:
+            database = options['database'] or os.path.join(
+                directory, 'benchmark.sqlite3')
+            media = f'{database}-media'
+            overrides = override_settings(
+                DEBUG=False,
+                MEDIA_ROOT=media,
+                TASKS_EAGER=True,
+                CACHES={'default': {
+                    'BACKEND': 'core.cache.SQLiteCache',
+                    'LOCATION': os.path.join(directory, 'cache.sqlite3'),
+                    'OPTIONS': {'MAX_ENTRIES': 100000},
+                }},
+            )
+            keepdb = options['database'] is not None
+            settings_dict = connection.settings_dict
+            settings_dict.setdefault('TEST', {})['NAME'] = database
+            old_name = settings_dict['NAME']
+            with overrides:
+                connection.creation.create_test_db(
+                    verbosity=0, autoclobber=True, serialize=False,
+                    keepdb=keepdb)
+                try:
+                    seed_time = None
+                    if not Post.objects.exists():
+                        started = time.perf_counter()
+                        self.seed(DATASETS[dataset])
+                        seed_time = time.perf_counter() - started
+                    result = {
+                        'dataset': dataset,
+                        'rows': self.row_counts(),
+                        'seed_seconds': seed_time,
+                        'environment': {
+                            'python': platform.python_version(),
+                            'django': django.get_version(),
+                            'sqlite': sqlite3.sqlite_version,
+                        },
+                        'routes': self.measure(),
+                    }
+                finally:
+                    connection.creation.destroy_test_db(
+                        old_name, verbosity=0, keepdb=keepdb)
+
+        output = options['output'] or f'benchmark_{dataset}.json'
+        with open(output, 'w') as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+        for name, route in result['routes'].items():
+            self.stdout.write(
+                '{:<18} {} p50 {:.1f} мс, p95 {:.1f} мс, p99 {:.1f} мс, '
+                'запросов {}'.format(name, route['status'], route['p50_ms'],
+                                     route['p95_ms'], route['p99_ms'],
+                                     route['queries']))
+        self.stdout.write(self.style.SUCCESS(f'Результат: {output}'))
+
+    def log(self, message):
+        self.stdout.write(message)
+
+    def seed(self, dataset):
+        # без общей транзакции SQLite синхронизирует диск после каждого INSERT
+        with transaction.atomic():
+            self.seed_rows(dataset)
+        bulk.refresh_derived(stdout=self.stdout)
+
+    def seed_rows(self, dataset):
+        rnd = self.rnd
+        vocabulary = [
+            ''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(3, 10)))
+            for _ in range(VOCABULARY_SIZE)
+        ]
+        word_weights = zipf_weights(len(vocabulary))
+        now = timezone.now()
+        posts = dataset['posts']
+        # посты равномерно распределены по последнему году
+        step = timedelta(days=365) / posts
+        start = now - timedelta(days=365)
+
+        password = make_password(None)
+        User.objects.bulk_create(
+            (User(username=f'user{number}', first_name='Пользователь',
+                  last_name=str(number), password=password)
+             for number in range(dataset['users']))
+        )
+        user_ids = list(User.objects.order_by('pk')
+                        .values_list('pk', flat=True))
+        user_weights = zipf_weights(len(user_ids))
+        Group.objects.bulk_create(
+            Group(title=f'Группа {number}', slug=f'group-{number}',
+                  description='Описание группы')
+            for number in range(dataset['groups'])
+        )
+        group_ids = list(Group.objects.values_list('pk', flat=True))
+        self.log(f'Пользователей: {len(user_ids)}, групп: {len(group_ids)}')
+
+        images = self.make_images()
+        with bulk.keep_dates():
+            for offset in range(0, posts, BATCH_SIZE):
+                batch = []
+                for number in range(offset, min(offset + BATCH_SIZE, posts)):
+                    moment = start + step * number
+                    batch.append(Post(
+                        author_id=rnd.choices(user_ids,
+                                              cum_weights=user_weights)[0],
+                        group_id=(rnd.choice(group_ids)
+                                  if rnd.random() < 0.7 else None),
+                        text=' '.join(rnd.choices(
+                            vocabulary, cum_weights=word_weights,
+                            k=rnd.randint(5, 60))),
+                        image=(rnd.choice(images)
+                               if rnd.random() < self.options['images']
+                               else ''),
+                        pub_date=moment,
+                        updated_at=moment,
+                    ))
+                Post.objects.bulk_create(batch)
+            self.log(f'Постов: {posts}')
+
+            # подписываются чаще на популярных авторов; популярность
+            # не связана с числом постов, иначе ленты растут квадратично
+            follows = set()
+            popular = rnd.sample(user_ids, len(user_ids))
+            for user_id in user_ids:
+                count = rnd.randint(0, self.options['follows'] * 2)
+                for author_id in rnd.choices(popular,
+                                             cum_weights=user_weights,
+                                             k=count):
+                    if author_id != user_id:
+                        follows.add((user_id, author_id))
+            Follow.objects.bulk_create(
+                (Follow(user_id=user_id, author_id=author_id)
+                 for user_id, author_id in follows)
+            )
+            self.log(f'Подписок: {len(follows)}')
+
+            first_post = Post.objects.order_by('pk').values_list(
+                'pk', flat=True).first()
+            comments = int(posts * self.options['comments'])
+            for offset in range(0, comments, BATCH_SIZE):
+                batch = []
+                for _ in range(min(BATCH_SIZE, comments - offset)):
+                    # свежие посты комментируют чаще
+                    number = posts - 1 - min(
+                        int(rnd.expovariate(10 / posts)), posts - 1)
+                    batch.append(Comment(
+                        post_id=first_post + number,
+                        author_id=rnd.choice(user_ids),
+                        text=' '.join(rnd.choices(vocabulary, k=8)),
+                        created=start + step * number
+                        + timedelta(minutes=rnd.randint(1, 600)),
+                    ))
+                Comment.objects.bulk_create(batch)
+            self.log(f'Комментариев: {comments}')
+
+        for name in images:
+            thumbnails.generate(name)
+
+    def make_images(self):
+        directory = os.path.join(settings.MEDIA_ROOT, 'posts')
+        os.makedirs(directory, exist_ok=True)
+        names = []
+        for number in range(IMAGE_POOL):
+            name = f'posts/benchmark-{number}.jpg'
+            color = tuple(self.rnd.randrange(256) for _ in range(3))
+            Image.new('RGB', (1600, 1200), color).save(
+                os.path.join(directory, os.path.basename(name)), quality=90)
+            names.append(name)
+        return names
+
+    @staticmethod
+    def row_counts():
+        return {
+            'users': User.objects.count(),
+            'groups': Group.objects.count(),
+            'posts': Post.objects.count(),
+            'follows': Follow.objects.count(),
+            'comments': Comment.objects.count(),
+        }
+
+    def samples(self):
+        """Значения параметров маршрутов: самые нагруженные объекты."""
+        viewer = User.objects.filter(
+            stats__isnull=False).order_by('-stats__posts_count').first()
+        target = (User.objects.exclude(pk=viewer.pk)
+                  .order_by('-stats__followers_count').first())
+        group = Group.objects.order_by('pk').first()
+        commented = Post.objects.order_by('-comments_count').first()
+        own = Post.objects.filter(author=viewer).first()
+        word = Post.objects.values_list('text', flat=True).first().split()[0]
+        self.viewer, self.target = viewer, target
+        self.defaults = {
+            'slug': group.slug,
+            'username': viewer.username,
+            'post_id': commented.pk,
+        }
+        self.special = {
+            'post_edit': {'post_id': own.pk},
+            'profile_follow': {'username': target.username},
+            'profile_unfollow': {'username': target.username},
+        }
+        self.queries = {'search': f'?q={word}'}
+
+    def routes(self):
+        for name, url in self.app_routes(posts_urls):
+            yield name, url
+        # JSON API рядом с HTML-страницами, которые он заменяет
+        for name, url in self.app_routes(api_urls):
+            yield f'{api_urls.app_name}:{name}', url
+
+    def app_routes(self, urls):
+        for pattern in urls.urlpatterns:
+            name = pattern.name
+            values = dict(self.defaults, **self.special.get(name, {}))
+            kwargs = {key: values[key] for key in pattern.pattern.converters}
+            url = reverse(f'{urls.app_name}:{name}', kwargs=kwargs)
+            yield name, url + self.queries.get(name, '')
+
+    def prepare(self, name):
+        """Возвращает подписку в исходное состояние вне замера."""
+        if name == 'profile_follow':
+            Follow.objects.filter(user=self.viewer,
+                                  author=self.target).delete()
+        elif name == 'profile_unfollow':
+            Follow.objects.get_or_create(user=self.viewer,
+                                         author=self.target)
+
+    def environ(self, name, url):
+        factory = RequestFactory()
+        cookie = f'sessionid={self.session}; csrftoken={self.csrf_cookie}'
+        if name in POST_ROUTES:
+            data = dict(POST_ROUTES[name], csrfmiddlewaretoken=self.csrf)
+            return factory.post(url, data, HTTP_COOKIE=cookie).environ
+        return factory.get(url, HTTP_COOKIE=cookie).environ
+
+    def call(self, handler, name, url):
+        """Один запрос через WSGI: время, код ответа и число запросов к БД."""
+        status = []
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        environ = self.environ(name, url)
+        started = time.perf_counter()
+        with connection.execute_wrapper(count):
+            result = handler(environ, lambda code, headers: status.append(
+                int(code.split()[0])))
+            try:
+                b''.join(result)
+            finally:
+                result.close()
+        return time.perf_counter() - started, status[0], len(queries)
+
+    def measure(self):
+        self.samples()
+        client = Client()
+        client.force_login(self.viewer)
+        self.session = client.cookies['sessionid'].value
+        request = HttpRequest()
+        self.csrf = get_token(request)
+        self.csrf_cookie = request.META['CSRF_COOKIE']
+        handler = WSGIHandler()
+
+        results = {}
+        for name, url in self.routes():
+            runs = []
+            for _ in range(self.options['warmup'] + self.options['requests']):
+                self.prepare(name)
+                runs.append(self.call(handler, name, url))
+            measured = runs[self.options['warmup']:] or runs
+            timings = sorted(elapsed for elapsed, _, _ in measured)
+            queries = [count for _, _, count in measured]
+            results[name] = {
+                'url': url,
+                'method': 'POST' if name in POST_ROUTES else 'GET',
+                'status': measured[-1][1],
+                'cold_ms': runs[0][0] * 1000,
+                'p50_ms': statistics.median(timings) * 1000,
+                'p95_ms': percentile(timings, 0.95) * 1000,
+                'p99_ms': percentile(timings, 0.99) * 1000,
+                'mean_ms': statistics.mean(timings) * 1000,
+                'queries': int(statistics.median(queries)),
+                'queries_max': max(queries),
+            }
+        return results
@@ -0,0 +1,167 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from posts.models import Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+# без кеша каждая страница выполняет все свои запросы
+NO_CACHE = {'default': {
+    'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+}}
+
+
+def is_problem(detail):
+    """Полный обход таблицы или сортировка во временном B-дереве."""
+    if 'USE TEMP B-TREE' in detail:
+        return True
+    # обход подзапроса читает уже отобранные строки, его план проверяется
+    # отдельными строками
+    return (detail.startswith('SCAN ')
+            and 'USING' not in detail
+            and 'VIRTUAL TABLE' not in detail
+            and 'CONSTANT ROW' not in detail
+            and not detail.startswith('SCAN subquery'))
+
+
+def bad_details(details):
+    """Строки плана, из-за которых запрос считается плохим."""
+    bad = [detail for detail in details if is_problem(detail)]
+    if any('VIRTUAL TABLE' in detail for detail in details):
+        # bm25 считается для каждого совпадения FTS5, поэтому выдача по
+        # релевантности всегда сортируется; индексом её не заменить
+        bad = [detail for detail in bad if 'USE TEMP B-TREE' not in detail]
+    return bad
+
+
+class Command(BaseCommand):
+    help = ('Открывает страницы posts, выполняет EXPLAIN QUERY PLAN для '
+            'каждого их SELECT и завершается ошибкой, если план содержит '
+            'SCAN без индекса или USE TEMP B-TREE.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN поддерживается '
+                               'только для SQLite.')
+        self.verbosity = options['verbosity']
+        with override_settings(CACHES=NO_CACHE), transaction.atomic():
+            problems = self.check_pages()
+            # follow_index и счётчики ничего не должны оставить в базе
+            transaction.set_rollback(True)
+        if problems:
+            raise CommandError(f'Запросов с плохим планом: {problems}')
+        self.stdout.write(self.style.SUCCESS('Все запросы используют '
+                                             'индексы.'))
+
+    def samples(self):
+        author = (User.objects.annotate(total=Count('posts'))
+                  .order_by('-total').first())
+        group = (Group.objects.annotate(total=Count('group_posts'))
+                 .order_by('-total').first())
+        post = (Post.objects.annotate(total=Count('comments'))
+                .order_by('-total').first())
+        if author is None or group is None or post is None:
+            raise CommandError('Нужны хотя бы один пост, группа и автор.')
+        word = post.text.split()[0] if post.text.split() else 'a'
+        return author, [
+            (reverse('posts:index'), 'cursor'),
+            (reverse('posts:group_list', kwargs={'slug': group.slug}),
+             'cursor'),
+            (reverse('posts:profile', kwargs={'username': author.username}),
+             'cursor'),
+            (reverse('posts:follow_index'), 'cursor'),
+            (reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+             'comments'),
+            (reverse('posts:search') + f'?q={word}', None),
+        ]
+
+    def check_pages(self):
+        viewer, pages = self.samples()
+        client = Client()
+        client.force_login(viewer)
+        problems = 0
+        for url, param in pages:
+            problems += self.check_page(client, url, param)
+        limit = self.celebrity_limit(viewer)
+        if limit is not None:
+            # гибридная лента: самый популярный из авторов зрителя
+            # становится «звездой»
+            with override_settings(FOLLOW_FANOUT_LIMIT=limit):
+                problems += self.check_page(
+                    client, reverse('posts:follow_index'), 'cursor')
+        return problems
+
+    @staticmethod
+    def celebrity_limit(viewer):
+        """Порог FOLLOW_FANOUT_LIMIT, при котором зритель читает «звезду»."""
+        followers = (UserStats.objects
+                     .filter(user__in=Follow.objects.filter(user=viewer)
+                             .values('author'))
+                     .order_by('-followers_count')
+                     .values_list('followers_count', flat=True).first())
+        if not followers:
+            return None
+        return followers - 1
+
+    def check_page(self, client, url, param):
+        problems = 0
+        urls = [url]
+        if param == 'cursor':
+            urls.append(f'{url}?cursor=')
+        for page_url in urls:
+            queries, response = self.capture(client, page_url)
+            problems += self.explain(page_url, queries)
+            page = self.next_page(response, param)
+            if page:
+                next_url = f'{url}?{param}={page}'
+                queries, _ = self.capture(client, next_url)
+                problems += self.explain(next_url, queries)
+        return problems
+
+    @staticmethod
+    def capture(client, url):
+        queries = []
+
+        def collect(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith('SELECT') and not many:
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(collect):
+            response = client.get(url)
+        return queries, response
+
+    @staticmethod
+    def next_page(response, param):
+        if response.context is None or param is None:
+            return None
+        page = response.context.get(
+            'comments' if param == 'comments' else 'page_obj')
+        return getattr(page, 'next_cursor', None)
+
+    def explain(self, url, queries):
+        problems = 0
+        seen = set()
+        self.stdout.write(url)
+        with connection.cursor() as cursor:
+            for sql, params in queries:
+                if sql in seen:
+                    continue
+                seen.add(sql)
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                details = [row[-1] for row in cursor.fetchall()]
+                bad = bad_details(details)
+                if bad:
+                    problems += 1
+                    self.stdout.write(self.style.ERROR(f'  {sql}'))
+                    for detail in bad:
+                        self.stdout.write(self.style.ERROR(f'    {detail}'))
+                elif self.verbosity > 1:
+                    self.stdout.write(f'  {sql}')
+                    for detail in details:
+                        self.stdout.write(f'    {detail}')
+        return problems
@@ -0,0 +1,95 @@
+import os
+import re
+import shutil
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from sorl.thumbnail import delete
+
+from posts import cards, etags, thumbnails
+from posts.models import Post
+from posts.storage import file_digest, hashed_name, post_images
+
+BATCH_SIZE = 500
+HASHED = re.compile(r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$')
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов в хранилище по содержимому: '
+            'одинаковые файлы сливаются в один, их миниатюры удаляются '
+            'и ставятся в очередь для общего файла.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет сделано.')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        moved = merged = missing = reclaimed = 0
+        # при --dry-run файлы не создаются, копии узнаются по хешу
+        targets = set()
+        for name in self.names():
+            path = post_images.path(name)
+            if not os.path.isfile(path):
+                missing += 1
+                self.stdout.write(f'нет файла: {name}')
+                continue
+            target = hashed_name(os.path.dirname(name), file_digest(path),
+                                 os.path.splitext(name)[1])
+            duplicate = target in targets or post_images.exists(target)
+            targets.add(target)
+            if duplicate:
+                merged += 1
+                reclaimed += os.path.getsize(path)
+            else:
+                moved += 1
+            self.stdout.write(f'{name} -> {target}')
+            if not self.dry_run:
+                self.move(name, target, duplicate)
+
+        prefix = 'Можно освободить' if self.dry_run else 'Освобождено'
+        self.stdout.write(f'Перенесено: {moved}; слито с копиями: {merged}; '
+                          f'без файла: {missing}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}: {reclaimed} байт исходников и миниатюры '
+            f'{moved + merged} старых имён'))
+
+    def names(self):
+        """Имена картинок в старой раскладке, пачками по имени."""
+        last = ''
+        while True:
+            # имена меняются по ходу обхода, поэтому не курсором
+            batch = list(Post.objects
+                         .exclude(image='')
+                         .filter(image__gt=last)
+                         .order_by('image')
+                         .values_list('image', flat=True)
+                         .distinct()[:BATCH_SIZE])
+            if not batch:
+                return
+            last = batch[-1]
+            yield from (name for name in batch if not HASHED.match(name))
+
+    def move(self, name, target, duplicate):
+        """
+        Ссылки переключаются на общий файл только после того, как он
+        создан, а старый файл удаляется последним: прерванный прогон
+        ничего не теряет.
+        """
+        if not duplicate:
+            target_path = post_images.path(target)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            try:
+                os.link(post_images.path(name), target_path)
+            except OSError:
+                shutil.copyfile(post_images.path(name), target_path)
+        with transaction.atomic():
+            posts = Post.objects.filter(image=name)
+            pks = list(posts.values_list('pk', flat=True))
+            posts.update(image=target)
+        for pk in pks:
+            cards.bump_post(pk)
+        etags.touch_posts(Post.objects.filter(pk__in=pks))
+        # миниатюры старого имени и сам файл
+        delete(name)
+        thumbnails.schedule(target)
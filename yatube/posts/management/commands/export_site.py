@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+
+
+class Command(BaseCommand):
+    help = ('Выгружает пользователей, группы, посты, комментарии и '
+            'подписки в NDJSON или CSV для резервной копии.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(export.FORMATS),
+                            default='ndjson')
+        parser.add_argument('--output',
+                            help='Файл выгрузки; без него - stdout.')
+        parser.add_argument('--cursor',
+                            help='Продолжить после записи с этим курсором; '
+                                 'строки дописываются в конец --output.')
+
+    def handle(self, *args, **options):
+        position = None
+        if options['cursor']:
+            position = export.decode_cursor(options['cursor'])
+            if position is None:
+                raise CommandError('Неверный курсор.')
+        lines = export.lines(export.site_sections(), options['format'],
+                             position)
+        if position is not None and options['format'] == 'csv':
+            # заголовок уже есть в начале прерванного файла
+            next(lines)
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        mode = 'a' if position is not None else 'w'
+        written = 0
+        with open(options['output'], mode, encoding='utf-8',
+                  newline='') as output:
+            for line in lines:
+                output.write(line)
+                written += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Записано строк: {written} в {options["output"]}'))
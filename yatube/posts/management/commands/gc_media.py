@@ -0,0 +1,140 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default, delete
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import ThumbnailError
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from posts.models import Post
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки постов без ссылок из базы, миниатюры без '
+            'записей в хранилище ключей sorl и записи о пропавших файлах.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет удалено.')
+        parser.add_argument('--rate', type=float, default=50,
+                            help='Не больше N удалений в секунду.')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Не трогать файлы моложе N секунд: они '
+                                 'могут принадлежать незавершённой загрузке.')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.delay = 1 / options['rate'] if options['rate'] > 0 else 0
+        self.newest = time.time() - options['min_age']
+        self.reclaimed = 0
+        self.removed = 0
+
+        self.collect_sources()
+        self.collect_thumbnails()
+        self.collect_kvstore()
+
+        prefix = 'Можно освободить' if self.dry_run else 'Освобождено'
+        self.stdout.write(f'{prefix}: {self.reclaimed} байт, '
+                          f'файлов: {self.removed}')
+
+    def files(self, directory):
+        """Обходит каталог потоково, не собирая список файлов целиком."""
+        root = os.path.join(settings.MEDIA_ROOT, directory)
+        if not os.path.isdir(root):
+            return
+        stack = [root]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat()
+                        if stat.st_mtime > self.newest:
+                            continue
+                        name = os.path.relpath(entry.path,
+                                               settings.MEDIA_ROOT)
+                        yield name.replace(os.sep, '/'), stat.st_size
+
+    def batches(self, iterable):
+        batch = []
+        for item in iterable:
+            batch.append(item)
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def collect_sources(self):
+        """Исходные картинки, на которые не ссылается ни один пост."""
+        for batch in self.batches(self.files('posts')):
+            live = set(Post.objects.filter(
+                image__in=[name for name, _ in batch]
+            ).values_list('image', flat=True))
+            for name, size in batch:
+                if name not in live:
+                    # delete убирает и миниатюры картинки
+                    self.remove(name, size + self.thumbnails_size(name),
+                                lambda: delete(name))
+
+    @staticmethod
+    def thumbnails_size(name):
+        """Сколько байт занимают миниатюры картинки."""
+        kvstore = default.kvstore
+        keys = kvstore._get(ImageFile(name, default.storage).key,
+                            identity='thumbnails') or []
+        total = 0
+        for key in keys:
+            thumbnail = kvstore._get(key)
+            if thumbnail is not None and thumbnail.exists():
+                total += thumbnail.storage.size(thumbnail.name)
+        return total
+
+    def collect_thumbnails(self):
+        """Файлы миниатюр, о которых не знает хранилище ключей."""
+        for name, size in self.files(
+                sorl_settings.THUMBNAIL_PREFIX.strip('/')):
+            if default.kvstore.get(ImageFile(name, default.storage)) is None:
+                self.remove(name, size,
+                            lambda: default.storage.delete(name))
+
+    def collect_kvstore(self):
+        """Записи хранилища ключей о файлах, которых больше нет."""
+        prefix = add_prefix('', 'image')
+        last_key = prefix
+        while True:
+            # SQLite не изолирует чтение курсора от удалений в той же
+            # таблице, поэтому записи выбираются пачками по ключу
+            batch = list(KVStore.objects
+                         .filter(key__startswith=prefix, key__gt=last_key)
+                         .order_by('key')
+                         .values_list('key', 'value')[:BATCH_SIZE])
+            if not batch:
+                break
+            last_key = batch[-1][0]
+            for _, value in batch:
+                try:
+                    image_file = deserialize_image_file(value)
+                except (ThumbnailError, ValueError, KeyError):
+                    continue
+                if image_file.exists():
+                    continue
+                self.remove(f'kvstore: {image_file.name}', 0,
+                            lambda: default.kvstore.delete(image_file))
+
+    def remove(self, name, size, action):
+        self.stdout.write(name)
+        self.reclaimed += size
+        self.removed += 1
+        if self.dry_run:
+            return
+        action()
+        if self.delay:
+            time.sleep(self.delay)
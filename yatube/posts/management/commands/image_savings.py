@@ -0,0 +1,58 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import get_thumbnail
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Создаёт варианты картинок постов и показывает, '
+            'сколько байт они экономят по сравнению с JPEG 960x339.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Обработать не больше N картинок.')
+
+    def handle(self, *args, **options):
+        # картинки лежат в подкаталогах по хешу, одна может быть
+        # у нескольких постов
+        names = (Post.objects.exclude(image='').order_by('image')
+                 .values_list('image', flat=True).distinct())
+        baseline = 0
+        totals = defaultdict(int)
+        count = 0
+        for name in names.iterator():
+            if options['limit'] is not None and count >= options['limit']:
+                break
+            try:
+                size = self.size(get_thumbnail(
+                    name, thumbnails.DEFAULT_GEOMETRY,
+                    **thumbnails.DEFAULT_OPTIONS))
+                sizes = {
+                    (format_, width): self.size(
+                        get_thumbnail(name, geometry, **variant_options))
+                    for format_, width, geometry, variant_options
+                    in thumbnails.variants()
+                }
+            except Exception as error:
+                self.stderr.write(f'{name}: {error}')
+                continue
+            baseline += size
+            for key, variant_size in sizes.items():
+                totals[key] += variant_size
+            count += 1
+
+        self.stdout.write(f'Картинок: {count}, форматы: '
+                          f'{", ".join(thumbnails.FORMATS)}')
+        self.stdout.write(f'JPEG {thumbnails.DEFAULT_GEOMETRY}: '
+                          f'{baseline} байт')
+        for (format_, width), total in sorted(totals.items()):
+            saved = 1 - total / baseline if baseline else 0
+            self.stdout.write(
+                f'{format_} {width}w: {total} байт, экономия {saved:.0%}')
+
+    @staticmethod
+    def size(thumbnail):
+        return thumbnail.storage.size(thumbnail.name)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс постов (SQLite FTS5).'
+
+    def handle(self, *args, **options):
+        if not search.rebuild():
+            raise CommandError('База данных не поддерживает FTS5.')
+        self.stdout.write('Полнотекстовый индекс перестроен.')
@@ -0,0 +1,69 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import UserStats
+from posts.stats import with_counts
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов и подписок пачками.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--users', type=int, nargs='+', default=None,
+                            help='Пересчитать только пользователей '
+                                 'с этими id.')
+
+    def handle(self, *args, **options):
+        fixed = total = 0
+        for users in self.batches(options['batch_size'], options['users']):
+            total += len(users)
+            fixed += self.store(users)
+        self.stdout.write(f'Проверено пользователей: {total}, '
+                          f'исправлено: {fixed}')
+
+    @staticmethod
+    def batches(batch_size, user_ids=None):
+        """Реальные счётчики пользователей пачками по batch_size."""
+        def counts(users):
+            return with_counts(users).order_by('pk').values_list(
+                'pk', 'real_posts', 'real_followers', 'real_following')
+
+        if user_ids is not None:
+            user_ids = sorted(set(user_ids))
+            for start in range(0, len(user_ids), batch_size):
+                yield list(counts(User.objects.filter(
+                    pk__in=user_ids[start:start + batch_size])))
+            return
+        last_pk = 0
+        while True:
+            users = list(counts(
+                User.objects.filter(pk__gt=last_pk))[:batch_size])
+            if not users:
+                return
+            last_pk = users[-1][0]
+            yield users
+
+    @staticmethod
+    def store(users):
+        """Записывает пачку счётчиков одной короткой транзакцией."""
+        current = UserStats.objects.in_bulk([pk for pk, *_ in users])
+        fixed = 0
+        with transaction.atomic():
+            for pk, posts, followers, following in users:
+                stats = current.get(pk)
+                if stats and (stats.posts_count, stats.followers_count,
+                              stats.following_count) == (
+                                  posts, followers, following):
+                    continue
+                UserStats.objects.update_or_create(
+                    user_id=pk,
+                    defaults={'posts_count': posts,
+                              'followers_count': followers,
+                              'following_count': following},
+                )
+                fixed += 1
+        return fixed
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import suggestions
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает общих подписчиков и предложения «кого '
+            'почитать» для всех пользователей; запускается по ночам, '
+            'днём их поддерживают сигналы подписок.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        suggestions.rebuild(stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            'Готово за {:.1f} с'.format(time.perf_counter() - started)))
@@ -0,0 +1,74 @@
+import os
+import time
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Заранее создаёт все варианты картинок постов в пуле '
+            'процессов. Прерванный прогон продолжается с контрольной точки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200)
+        parser.add_argument('--workers', type=int,
+                            default=os.cpu_count() or 2)
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.MEDIA_ROOT, '.warm_thumbnails'),
+            help='Файл с id последнего обработанного поста.')
+        parser.add_argument('--restart', action='store_true',
+                            help='Начать с начала, игнорируя контрольную '
+                                 'точку.')
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        last_pk = 0 if options['restart'] else self.load(checkpoint)
+        posts = Post.objects.exclude(image='').order_by('pk')
+        total = posts.filter(pk__gt=last_pk).count()
+        self.stdout.write(f'Постов с картинками: {total}, '
+                          f'начинаем после id {last_pk}')
+
+        # дочерние процессы не должны делить соединения с родителем
+        connections.close_all()
+        done = 0
+        started = time.perf_counter()
+        with Pool(options['workers'],
+                  initializer=thumbnails.init_worker) as pool:
+            while True:
+                chunk = list(posts.filter(pk__gt=last_pk)
+                             .values_list('pk', 'image')
+                             [:options['chunk_size']])
+                if not chunk:
+                    break
+                names = list(dict.fromkeys(image for _, image in chunk))
+                pool.map(thumbnails.generate, names)
+                last_pk = chunk[-1][0]
+                self.save(checkpoint, last_pk)
+                done += len(chunk)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    '{}/{} постов, {:.1f} постов/с, id {}'.format(
+                        done, total, done / elapsed, last_pk))
+        self.stdout.write(self.style.SUCCESS('Миниатюры готовы.'))
+
+    @staticmethod
+    def load(checkpoint):
+        try:
+            with open(checkpoint) as file:
+                return int(file.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    @staticmethod
+    def save(checkpoint, last_pk):
+        """Атомарно записывает контрольную точку."""
+        temporary = f'{checkpoint}.tmp'
+        with open(temporary, 'w') as file:
+            file.write(str(last_pk))
+        os.replace(temporary, checkpoint)
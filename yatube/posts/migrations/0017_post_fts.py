@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def create_fts(apps, schema_editor):
+    from posts import search
+    search.rebuild(schema_editor.connection)
+
+
+def drop_fts(apps, schema_editor):
+    from posts import search
+    if not search.fts_available(schema_editor.connection):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(
+                f'DROP TRIGGER IF EXISTS {search.FTS_TABLE}_{suffix}')
+        cursor.execute(f'DROP TABLE IF EXISTS {search.FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_post_comments_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
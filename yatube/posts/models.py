@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.db.models import UniqueConstraint
+
+from .storage import post_images
 # Create your models here.
 
 
@@ -29,6 +31,10 @@ class Post(CreatedModel):
         auto_now_add=True,
         db_index=True
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True
+    )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -43,11 +49,27 @@ class Post(CreatedModel):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=post_images,
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        'Комментариев',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         ordering = ['-pub_date']
+        # по возрастанию: обратный проход отдаёт порядок
+        # (-pub_date, -id) keyset-пагинации без сортировки
+        indexes = [
+            models.Index(fields=['group', 'pub_date'],
+                         name='post_group_pub_date_idx'),
+            models.Index(fields=['author', 'pub_date'],
+                         name='post_author_pub_date_idx'),
+            # сколько постов ссылается на файл картинки
+            models.Index(fields=['image'], name='post_image_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.text[:15]
@@ -68,6 +90,10 @@ class Comment(CreatedModel):
 
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.text
@@ -84,6 +110,105 @@ class Follow(models.Model):
                                )
 
     class Meta:
+        # уникальность начинается с author и не помогает искать по user
+        indexes = [
+            models.Index(fields=['user', 'author'],
+                         name='follow_user_author_idx'),
+        ]
         constraints = [
             UniqueConstraint(fields=['author', 'user'], name='unique_follow')
         ]
+
+
+class TimelineEntry(models.Model):
+    """Запись материализованной ленты подписок пользователя."""
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='timeline'
+                             )
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name='timeline_entries'
+                             )
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               related_name='+'
+                               )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['user', 'pub_date', 'post'],
+                         name='timeline_user_pub_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author_idx'),
+        ]
+        constraints = [
+            UniqueConstraint(fields=['user', 'post'],
+                             name='unique_timeline_entry')
+        ]
+
+
+class UserStats(models.Model):
+    """Денормализованные счётчики пользователя."""
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='stats'
+                                )
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+
+    def __str__(self) -> str:
+        return f'{self.user}: {self.posts_count}'
+
+
+class CoFollow(models.Model):
+    """Сколько пользователей подписаны и на author, и на other."""
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               related_name='+',
+                               db_index=False
+                               )
+    other = models.ForeignKey(User,
+                              on_delete=models.CASCADE,
+                              related_name='+'
+                              )
+    count = models.PositiveIntegerField('Общих подписчиков', default=0)
+
+    class Meta:
+        # предложения считаются по этому индексу, не читая таблицу
+        indexes = [
+            models.Index(fields=['author', 'other', 'count'],
+                         name='cofollow_author_other_idx'),
+        ]
+        constraints = [
+            UniqueConstraint(fields=['author', 'other'],
+                             name='unique_cofollow')
+        ]
+
+
+class Suggestion(models.Model):
+    """Автор, на которого стоит подписаться, и его вес для пользователя."""
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='suggestions'
+                             )
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               related_name='+'
+                               )
+    score = models.PositiveIntegerField('Вес')
+
+    class Meta:
+        # обратный проход по индексу отдаёт лучших без сортировки
+        indexes = [
+            models.Index(fields=['user', 'score'],
+                         name='suggestion_user_score_idx'),
+        ]
+        constraints = [
+            UniqueConstraint(fields=['user', 'author'],
+                             name='unique_suggestion')
+        ]
@@ -0,0 +1,161 @@
+import base64
+import binascii
+import re
+
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+from .utils import LIMIT_PAGE, CursorPage, cursor_page
+
+FTS_TABLE = 'posts_post_fts'
+MARK_START = '\x02'
+MARK_END = '\x03'
+SNIPPET_TOKENS = 16
+
+CREATE_TABLE = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+    "text, content='posts_post', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+CREATE_TRIGGERS = (
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON posts_post '
+    f'BEGIN INSERT INTO {FTS_TABLE}(rowid, text) '
+    'VALUES (new.id, new.text); END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON posts_post '
+    f"BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) "
+    "VALUES ('delete', old.id, old.text); END",
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au '
+    'AFTER UPDATE OF text ON posts_post '
+    f"BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    f'INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); END',
+)
+SEARCH_SQL = (
+    'SELECT id, rank, snip FROM ('
+    f'SELECT rowid AS id, bm25({FTS_TABLE}) AS rank, '
+    f"snippet({FTS_TABLE}, 0, '{MARK_START}', '{MARK_END}', '…', "
+    f'{SNIPPET_TOKENS}) AS snip '
+    f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+    ') WHERE rank > %s OR (rank = %s AND id > %s) '
+    'ORDER BY rank, id LIMIT %s'
+)
+
+
+_available = {}
+
+
+def fts_available(conn=connection):
+    """FTS5 есть только у SQLite, собранного с этим модулем."""
+    if conn.alias not in _available:
+        found = False
+        if conn.vendor == 'sqlite':
+            with conn.cursor() as cursor:
+                cursor.execute('PRAGMA compile_options')
+                found = any(row[0] == 'ENABLE_FTS5'
+                            for row in cursor.fetchall())
+        _available[conn.alias] = found
+    return _available[conn.alias]
+
+
+def install(conn=connection):
+    """Создаёт FTS5-таблицу и триггеры синхронизации, если их нет."""
+    if not fts_available(conn):
+        return False
+    if Post._meta.db_table not in conn.introspection.table_names():
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute(CREATE_TABLE)
+        for sql in CREATE_TRIGGERS:
+            cursor.execute(sql)
+    return True
+
+
+def rebuild(conn=connection):
+    """Перестраивает индекс заново по таблице постов."""
+    if not install(conn):
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def match_expression(query):
+    """
+    Превращает пользовательский ввод в безопасное выражение MATCH:
+    каждое слово берётся в кавычки, слова объединяются через AND.
+    """
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def highlight(snippet):
+    """Экранирует фрагмент и подсвечивает совпадения тегом <mark>."""
+    return mark_safe(
+        escape(snippet)
+        .replace(MARK_START, '<mark>')
+        .replace(MARK_END, '</mark>')
+    )
+
+
+def encode_position(rank, pk):
+    raw = f'{rank!r}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_position(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        rank, pk = raw.decode().split('|')
+        return float(rank), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def search_posts(query, token=None, per_page=LIMIT_PAGE, extra_query=''):
+    """
+    Страница результатов поиска, упорядоченных по релевантности (bm25).
+
+    Без FTS5 используется медленный поиск через LIKE.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return CursorPage([], query=extra_query)
+    if not fts_available():
+        return like_search(query, token, per_page, extra_query)
+
+    position = decode_position(token) if token else None
+    rank, last_pk = position or (float('-inf'), 0)
+    with connection.cursor() as cursor:
+        cursor.execute(SEARCH_SQL,
+                       [expression, rank, rank, last_pk, per_page + 1])
+        rows = cursor.fetchall()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        [pk for pk, _, _ in rows])
+    results = []
+    for pk, _, snippet in rows:
+        post = posts.get(pk)
+        if post is not None:
+            post.snippet = highlight(snippet)
+            results.append(post)
+    next_cursor = None
+    if has_next:
+        next_cursor = encode_position(rows[-1][1], rows[-1][0])
+    return CursorPage(results, next_cursor=next_cursor, query=extra_query)
+
+
+def like_search(query, token, per_page, extra_query):
+    """Поиск через LIKE '%…%' для баз без FTS5."""
+    post_list = Post.objects.select_related('author', 'group')
+    for word in re.findall(r'\w+', query):
+        post_list = post_list.filter(text__icontains=word)
+    page = cursor_page(post_list, token, per_page)
+    page.query = extra_query
+    for post in page:
+        post.snippet = escape(post.text[:200])
+    return page
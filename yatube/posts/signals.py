@@ -0,0 +1,112 @@
+from django.db import connections
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import (cards, etags, follows, search, stats, storage, suggestions,
+               timeline)
+from .models import Comment, Follow, Group, Post
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        old = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'image').first()
+        if old is None:
+            return
+        group_id, instance.replaced_image = old
+        # пост могли перенести в другую группу: её лента тоже изменится
+        etags.touch(*etags.post_scopes(instance.author_id, group_id))
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, raw=False, **kwargs):
+    cards.bump_post(instance.pk)
+    etags.touch(*etags.post_scopes(instance.author_id, instance.group_id))
+    if created and not raw:
+        stats.bump(instance.author_id, 'posts_count', 1)
+        timeline.fan_out(instance)
+    replaced = getattr(instance, 'replaced_image', '')
+    if replaced and replaced != instance.image.name:
+        storage.schedule_release(replaced)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    cards.bump_post(instance.pk)
+    etags.touch(*etags.post_scopes(instance.author_id, instance.group_id))
+    stats.bump(instance.author_id, 'posts_count', -1)
+    storage.schedule_release(instance.image.name)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(instance.author_id, 'followers_count', 1)
+        stats.bump(instance.user_id, 'following_count', 1)
+        timeline.backfill(instance.user_id, instance.author_id)
+        suggestions.schedule(instance.user_id, instance.author_id)
+        follows.forget(instance.user_id)
+        etags.touch(etags.author_scope(instance.author_id),
+                    etags.follower_scope(instance.user_id))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    stats.bump(instance.author_id, 'followers_count', -1)
+    stats.bump(instance.user_id, 'following_count', -1)
+    timeline.drop(instance.user_id, instance.author_id)
+    timeline.settle(instance.author_id)
+    suggestions.schedule(instance.user_id, instance.author_id)
+    follows.forget(instance.user_id)
+    etags.touch(etags.author_scope(instance.author_id),
+                etags.follower_scope(instance.user_id))
+
+
+@receiver(pre_save, sender=Comment)
+def comment_saving(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        # в админке комментарий могут перенести к другому посту
+        instance.previous_post_id = Comment.objects.filter(
+            pk=instance.pk).values_list('post_id', flat=True).first()
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, 'previous_post_id', None)
+    moved = not created and previous != instance.post_id
+    if instance.post_id and (created or moved):
+        Post.objects.filter(pk=instance.post_id).update(
+            comments_count=F('comments_count') + 1)
+    if previous and moved:
+        Post.objects.filter(pk=previous, comments_count__gt=0).update(
+            comments_count=F('comments_count') - 1)
+    # правка текста тоже меняет карточку и страницу поста
+    post_ids = {post_id for post_id in (instance.post_id, previous)
+                if post_id}
+    for post_id in post_ids:
+        cards.bump_post(post_id)
+    etags.touch_posts(Post.objects.filter(pk__in=post_ids))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.post_id:
+        Post.objects.filter(pk=instance.post_id, comments_count__gt=0).update(
+            comments_count=F('comments_count') - 1)
+        cards.bump_post(instance.post_id)
+        etags.touch_posts(Post.objects.filter(pk=instance.post_id))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    cards.bump_group(instance.pk)
+    etags.touch(etags.GROUPS)
+
+
+def install_search(sender, using, **kwargs):
+    search.install(connections[using])
@@ -0,0 +1,56 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Follow, Post, UserStats
+
+
+def _count(queryset, field):
+    """Подзапрос COUNT(*) по пользователю из внешнего запроса."""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    ), 0)
+
+
+def with_counts(users):
+    """Аннотирует пользователей реальными значениями счётчиков."""
+    return users.annotate(
+        real_posts=_count(Post.objects, 'author'),
+        real_followers=_count(Follow.objects, 'author'),
+        real_following=_count(Follow.objects, 'user'),
+    )
+
+
+def rebuild(user_id):
+    """Пересчитывает счётчики пользователя по таблицам."""
+    return UserStats.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            'posts_count': Post.objects.filter(author_id=user_id).count(),
+            'followers_count': Follow.objects.filter(
+                author_id=user_id).count(),
+            'following_count': Follow.objects.filter(
+                user_id=user_id).count(),
+        },
+    )[0]
+
+
+def bump(user_id, field, delta):
+    """Атомарно сдвигает счётчик; отсутствующая строка пересчитывается."""
+    stats = UserStats.objects.filter(user_id=user_id)
+    if delta < 0:
+        stats = stats.filter(**{f'{field}__gte': -delta})
+    updated = stats.update(**{field: F(field) + delta})
+    if not updated and delta > 0:
+        rebuild(user_id)
+
+
+def for_user(user_id):
+    """Счётчики пользователя; строка создаётся при первом обращении."""
+    try:
+        return UserStats.objects.get(user_id=user_id)
+    except UserStats.DoesNotExist:
+        return rebuild(user_id)
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import tempfile
+import time
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# файл, на который только что сослалась новая загрузка, не удаляется:
+# пост с ним может быть ещё не сохранён
+RELEASE_MIN_AGE = 5 * 60
+CHUNK_SIZE = 64 * 1024
+
+
+def hashed_name(directory, hexdigest, extension):
+    """Имя файла в хранилище: каталог, два знака хеша, хеш."""
+    return '/'.join(filter(None, (
+        directory, hexdigest[:2], hexdigest + extension.lower())))
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище картинок постов по содержимому: файл называется хешем
+    своих байтов, поэтому одинаковые загрузки делят один файл и, так
+    как миниатюры sorl привязаны к имени, один набор миниатюр.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # имя всё равно заменяется хешем в _save
+        return name
+
+    def _save(self, name, content):
+        from . import thumbnails
+
+        directory, basename = os.path.split(name)
+        os.makedirs(self.path(directory), exist_ok=True)
+        digest = hashlib.sha256()
+        # хеш считается, пока загрузка пишется во временный файл
+        handle, temp_path = tempfile.mkstemp(dir=self.path(directory),
+                                             suffix='.part')
+        try:
+            with os.fdopen(handle, 'wb') as temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+            name = hashed_name(directory, digest.hexdigest(),
+                               os.path.splitext(basename)[1])
+            path = self.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.reuse(path):
+                os.unlink(temp_path)
+            else:
+                os.chmod(temp_path, self.file_permissions_mode or 0o644)
+                os.replace(temp_path, path)
+                # прежний файл с этим именем мог не обработаться
+                thumbnails.reset(name)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return name
+
+    @staticmethod
+    def reuse(path):
+        """
+        Продлевает жизнь уже сохранённому файлу с тем же содержимым:
+        отметка времени защищает его от release и gc_media.
+        """
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # файла нет или release только что убрал его в сторону
+            return False
+        return True
+
+
+post_images = ContentAddressedStorage()
+
+
+def release(name):
+    """
+    Удаляет картинку и её миниатюры, когда на неё не ссылается больше
+    ни один пост; выполняется воркером очереди.
+
+    Файл сначала переименовывается, и только потом ссылки и время
+    изменения проверяются ещё раз: загрузка того же содержимого
+    в этот момент либо успела обновить время файла, и он
+    возвращается на место, либо пишет файл заново.
+    """
+    from sorl.thumbnail import delete
+
+    from .models import Post
+
+    def referenced():
+        return Post.objects.filter(image=name).exists()
+
+    if not name or referenced():
+        return
+    path = post_images.path(name)
+    released = path + '.released'
+    try:
+        os.replace(path, released)
+    except FileNotFoundError:
+        delete(name, delete_file=False)
+        return
+    if (time.time() - os.path.getmtime(released) < RELEASE_MIN_AGE
+            or referenced()):
+        # содержимое то же, поэтому заменить им новую копию не страшно
+        os.replace(released, path)
+        return
+    os.unlink(released)
+    delete(name, delete_file=False)
+
+
+def schedule_release(name):
+    from core import tasks
+
+    if name:
+        # раньше RELEASE_MIN_AGE свежий файл release всё равно не удалит
+        tasks.enqueue(release, args=[name], priority=tasks.LOW,
+                      delay=RELEASE_MIN_AGE)
@@ -0,0 +1,182 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from . import etags, follows
+from .models import CoFollow, Follow, Suggestion
+
+# пересчёт всех предложений идёт пачками пользователей по id
+BATCH_SIZE = 1000
+
+
+def top_n():
+    """Сколько предложений хранится для каждого пользователя."""
+    return getattr(settings, 'SUGGESTIONS_COUNT', 20)
+
+
+def max_following():
+    """
+    Подписки пользователя, который читает больше стольких авторов,
+    не учитываются в общих подписчиках: пар у него слишком много,
+    а связи между ними почти ничего не говорят.
+    """
+    return getattr(settings, 'SUGGESTIONS_MAX_FOLLOWING', 500)
+
+
+def pairs(author_id, other_id, count):
+    yield CoFollow(author_id=author_id, other_id=other_id, count=count)
+    yield CoFollow(author_id=other_id, other_id=author_id, count=count)
+
+
+def light_followers(author_id):
+    """
+    Подписчики автора, которые учитываются в общих подписчиках:
+    читают не больше max_following авторов.
+    """
+    fans = Follow.objects.filter(author_id=author_id).values('user_id')
+    return (Follow.objects.filter(user_id__in=fans)
+            .values('user_id')
+            .annotate(following=Count('pk'))
+            .filter(following__lte=max_following())
+            .values('user_id'))
+
+
+def recount(user_id, author_id, others):
+    """
+    Задача после подписки или отписки: пересчитывает по таблице
+    подписок пары author_id с авторами others и предложения user_id.
+
+    others - подписки пользователя в момент события, их передаёт
+    schedule. Счётчики не сдвигаются на единицу, а считаются заново,
+    поэтому задачи можно выполнять в любом порядке и повторять.
+    """
+    if others:
+        users = light_followers(author_id)
+        for start in range(0, len(others), follows.IN_LIMIT):
+            chunk = others[start:start + follows.IN_LIMIT]
+            counts = (Follow.objects
+                      .filter(author_id__in=chunk, user_id__in=users)
+                      .values('author_id')
+                      .annotate(count=Count('pk'))
+                      .values_list('author_id', 'count'))
+            with transaction.atomic():
+                (CoFollow.objects.filter(author_id=author_id,
+                                         other_id__in=chunk)
+                 | CoFollow.objects.filter(author_id__in=chunk,
+                                           other_id=author_id)).delete()
+                CoFollow.objects.bulk_create(
+                    (pair
+                     for other_id, count in counts
+                     for pair in pairs(author_id, other_id, count)),
+                    ignore_conflicts=True)
+    refresh(user_id)
+
+
+def schedule(user_id, author_id):
+    """
+    Ставит пересчёт после подписки или отписки в очередь; вызывается
+    из сигнала, пока набор подписок в кеше ещё не сброшен.
+    """
+    from core import tasks
+
+    others = [other for other in follows.followed_ids(user_id)
+              if other != author_id]
+    # как в rebuild: подписки того, кто читает больше max_following
+    # авторов, пар не меняют. Переход через порог исправит ночной
+    # пересчёт
+    if len(others) + 1 > max_following():
+        others = []
+    tasks.enqueue(recount, args=[user_id, author_id, others],
+                  priority=tasks.LOW)
+
+
+def refresh(user_id):
+    """
+    Пересчитывает предложения одного пользователя: авторы, у которых
+    больше всего общих подписчиков с теми, кого он читает.
+
+    Предложения остальных пользователей, которых задела подписка,
+    обновляет ночной recompute_suggestions.
+    """
+    authors = follows.authors_filter(user_id)
+    best = (CoFollow.objects
+            .filter(author_id__in=authors)
+            .exclude(other_id__in=authors)
+            .exclude(other_id=user_id)
+            .values('other_id')
+            .annotate(score=Sum('count'))
+            .order_by('-score', 'other_id')[:top_n()])
+    with transaction.atomic():
+        Suggestion.objects.filter(user_id=user_id).delete()
+        Suggestion.objects.bulk_create(
+            Suggestion(user_id=user_id, author_id=row['other_id'],
+                       score=row['score'])
+            for row in best)
+    etags.touch(etags.suggestion_scope(user_id))
+
+
+def for_user(user, limit=5):
+    """Лучшие предложения одним запросом по индексу (user, score)."""
+    if not user.is_authenticated:
+        return []
+    return [suggestion.author for suggestion in
+            Suggestion.objects.filter(user=user)
+            .select_related('author')
+            .order_by('-score')[:limit]]
+
+
+def rebuild(stdout=None):
+    """
+    Собирает общих подписчиков и предложения всех пользователей
+    заново запросами INSERT ... SELECT: база считает пары и лучших
+    авторов сама, в Python строки не читаются.
+    """
+    quote = connection.ops.quote_name
+    cofollow_table = quote(CoFollow._meta.db_table)
+    suggestion_table = quote(Suggestion._meta.db_table)
+    follow_table = quote(Follow._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {cofollow_table}')
+        cursor.execute(
+            f'INSERT INTO {cofollow_table} (author_id, other_id, count) '
+            f'SELECT a.author_id, b.author_id, COUNT(*) '
+            f'FROM {follow_table} a JOIN {follow_table} b '
+            f'ON b.user_id = a.user_id AND b.author_id != a.author_id '
+            f'WHERE a.user_id IN (SELECT user_id FROM {follow_table} '
+            f'GROUP BY user_id HAVING COUNT(*) <= %s) '
+            f'GROUP BY a.author_id, b.author_id',
+            [max_following()],
+        )
+        cursor.execute(f'SELECT MAX(user_id) FROM {follow_table}')
+        last_user = cursor.fetchone()[0] or 0
+    for start in range(0, last_user + 1, BATCH_SIZE):
+        # короткие транзакции: сайт не ждёт всего пересчёта
+        with transaction.atomic(), connection.cursor() as cursor:
+            bounds = [start, start + BATCH_SIZE]
+            cursor.execute(
+                f'DELETE FROM {suggestion_table} '
+                f'WHERE user_id >= %s AND user_id < %s', bounds)
+            cursor.execute(
+                f'INSERT INTO {suggestion_table} (user_id, author_id, score) '
+                f'SELECT user_id, other_id, score FROM ('
+                f'SELECT user_id, other_id, score, '
+                f'ROW_NUMBER() OVER (PARTITION BY user_id '
+                f'ORDER BY score DESC, other_id) AS place '
+                f'FROM (SELECT f.user_id, c.other_id, SUM(c.count) AS score '
+                f'FROM {follow_table} f JOIN {cofollow_table} c '
+                f'ON c.author_id = f.author_id '
+                f'WHERE f.user_id >= %s AND f.user_id < %s '
+                f'AND c.other_id != f.user_id '
+                f'GROUP BY f.user_id, c.other_id) scores '
+                # уже прочитанные авторы отсекаются после группировки:
+                # строк в ней в разы меньше, чем в соединении
+                f'WHERE NOT EXISTS (SELECT 1 FROM {follow_table} g '
+                f'WHERE g.user_id = scores.user_id '
+                f'AND g.author_id = scores.other_id)) ranked '
+                f'WHERE place <= %s',
+                bounds + [top_n()],
+            )
+    etags.touch(etags.SUGGESTIONS)
+    if stdout is not None:
+        stdout.write(f'Пар общих подписчиков: {CoFollow.objects.count()}, '
+                     f'предложений: {Suggestion.objects.count()}')
@@ -0,0 +1,12 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts import cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_cards(posts):
+    """Карточки всех постов страницы: кеш и миниатюры читаются разом."""
+    return [mark_safe(html) for html in cards.render_many(posts)]
@@ -0,0 +1,34 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+def srcset(candidates):
+    return ', '.join(f'{url} {width}w' for url, width in candidates)
+
+
+@register.inclusion_tag('posts/includes/image.html')
+def post_image(image, found=None):
+    """
+    Картинка поста в разметке <picture>: AVIF/WEBP там, где их умеет
+    Pillow, и прогрессивный JPEG как запасной вариант. Пока варианты
+    создаются в фоне, выводится заглушка; в запросе ничего не генерируется.
+
+    found - варианты, заранее прочитанные для всей страницы.
+    """
+    if found is None:
+        found = thumbnails.cached_variants(image)
+    found = dict(found)
+    jpeg = found.pop('JPEG', [])
+    return {
+        'image': image,
+        'sources': [
+            (thumbnails.MIME_TYPES[format_], srcset(candidates))
+            for format_, candidates in found.items()
+        ],
+        'fallback': jpeg[-1][0] if jpeg else None,
+        'srcset': srcset(jpeg),
+        'sizes': thumbnails.SIZES,
+    }
@@ -7,6 +7,8 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 import tempfile
 from django.conf import settings
 import shutil
+from io import BytesIO
+from PIL import Image
 from django.core.cache import cache
 
 User = get_user_model()
@@ -141,3 +143,59 @@ class PostFormsTest(TestCase):
             follow=True
         )
         self.assertRedirects(response, '/auth/login/?next=/posts/1/edit/')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_MAX_EDGE=200)
+class ImageUploadTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='photographer')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        cache.clear()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def upload(self, name, content):
+        return self.client.post(
+            reverse('posts:post_create'),
+            data={'text': name, 'image': SimpleUploadedFile(name, content)})
+
+    def test_photo_is_normalized(self):
+        """Поворот применяется, EXIF удаляется, размер ограничивается."""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # повернуть на 90 градусов
+        exif[0x010F] = 'Phone'
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'red').save(buffer, 'JPEG', exif=exif)
+        self.upload('photo.jpg', buffer.getvalue())
+        post = Post.objects.get(text='photo.jpg')
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.size, (150, 200))
+            self.assertEqual(dict(stored.getexif()), {})
+
+    def test_transparency_kept(self):
+        """Картинка с прозрачностью сохраняется в PNG."""
+        buffer = BytesIO()
+        Image.new('RGBA', (300, 100), (0, 0, 255, 100)).save(buffer, 'PNG')
+        self.upload('logo.png', buffer.getvalue())
+        post = Post.objects.get(text='logo.png')
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.format, 'PNG')
+            self.assertEqual(stored.size, (200, 67))
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_huge_image_rejected(self):
+        """Слишком большая картинка отклоняется по заголовку."""
+        buffer = BytesIO()
+        Image.new('RGB', (100, 100)).save(buffer, 'PNG')
+        response = self.upload('huge.png', buffer.getvalue())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors['image'])
+        self.assertFalse(Post.objects.filter(text='huge.png').exists())
@@ -1,7 +1,10 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 
-from ..models import Group, Post
+from ..models import Follow, Group, Post, UserStats
 
 User = get_user_model()
 
@@ -57,3 +60,36 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, expected_value)
+
+
+class UserStatsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def test_counters_follow_writes_and_deletes(self):
+        """Счётчики меняются при создании и удалении постов и подписок."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Post.objects.create(author=self.author, text='Ещё пост')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        stats = UserStats.objects.get(user=self.author)
+        self.assertEqual(
+            (stats.posts_count, stats.followers_count), (2, 1))
+        self.assertEqual(
+            UserStats.objects.get(user=self.reader).following_count, 1)
+
+        post.delete()
+        follow.delete()
+        stats.refresh_from_db()
+        self.assertEqual(
+            (stats.posts_count, stats.followers_count), (1, 0))
+
+    def test_rebuild_command_repairs_drift(self):
+        """Команда rebuild_user_stats исправляет рассинхронизацию."""
+        Post.objects.create(author=self.author, text='Пост')
+        UserStats.objects.filter(user=self.author).update(posts_count=42)
+        call_command('rebuild_user_stats', batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 1)
@@ -0,0 +1,168 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# сколько запросов к базе может сделать страница вместе с шаблонами,
+# включая поиск миниатюр в хранилище ключей sorl; число не должно
+# зависеть от количества постов или комментариев
+QUERY_BUDGETS = {
+    'posts:index': 5,
+    'posts:group_list': 7,
+    # в профиле и ленте подписок есть блок «кого почитать»
+    'posts:profile': 10,
+    # в холодном кеше сюда входит загрузка набора подписок
+    'posts:follow_index': 8,
+    'posts:search': 4,
+    'posts:post_detail': 9,
+}
+ROW_COUNTS = (1, 10, 100)
+
+
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='budget_author')
+        cls.reader = User.objects.create_user(username='budget_reader')
+        cls.group = Group.objects.create(title='Группа', slug='budget',
+                                         description='Описание')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.post = Post.objects.create(author=cls.author, text='бюджет 0',
+                                       group=cls.group,
+                                       image='posts/budget-0.jpg')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def add_posts(self, total):
+        for number in range(Post.objects.count(), total):
+            author = User.objects.create_user(username=f'budget_{number}')
+            Follow.objects.create(user=self.reader, author=author)
+            Post.objects.create(author=author, text=f'бюджет {number}',
+                                group=self.group,
+                                image=f'posts/budget-{number}.jpg')
+
+    def add_comments(self, total):
+        for number in range(self.post.comments.count(), total):
+            author = User.objects.create_user(username=f'commenter_{number}')
+            Comment.objects.create(post=self.post, author=author,
+                                   text=f'Комментарий {number}')
+
+    def count_queries(self, url, data=None):
+        # карточки и миниатюры читаются из холодного кеша
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def check_budget(self, name, url, add_rows, data=None):
+        counts = []
+        for total in ROW_COUNTS:
+            add_rows(total)
+            counts.append(self.count_queries(url, data))
+        self.assertEqual(len(set(counts)), 1,
+                         f'{name}: число запросов растёт с данными: {counts}')
+        self.assertLessEqual(counts[0], QUERY_BUDGETS[name],
+                             f'{name}: превышен бюджет запросов')
+
+    def test_feeds(self):
+        """Ленты укладываются в бюджет при 1, 10 и 100 постах."""
+        urls = {
+            'posts:index': reverse('posts:index'),
+            'posts:group_list': reverse('posts:group_list',
+                                        kwargs={'slug': self.group.slug}),
+            'posts:follow_index': reverse('posts:follow_index'),
+            'posts:search': reverse('posts:search'),
+        }
+        for name, url in urls.items():
+            with self.subTest(view=name):
+                data = {'q': 'бюджет'} if name == 'posts:search' else None
+                self.check_budget(name, url, self.add_posts, data)
+
+    def test_profile(self):
+        """Профиль автора укладывается в бюджет при 1, 10 и 100 постах."""
+        url = reverse('posts:profile', kwargs={'username': self.author})
+
+        def add_own_posts(total):
+            for number in range(self.author.posts.count(), total):
+                Post.objects.create(author=self.author, text=f'пост {number}',
+                                    group=self.group,
+                                    image=f'posts/own-{number}.jpg')
+
+        self.check_budget('posts:profile', url, add_own_posts)
+
+    def test_post_detail(self):
+        """Страница поста в бюджете при 1, 10 и 100 комментариях."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.check_budget('posts:post_detail', url, self.add_comments)
+
+
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='plan_author')
+        reader = User.objects.create_user(username='plan_reader')
+        group = Group.objects.create(title='Группа', slug='plan',
+                                     description='Описание')
+        Follow.objects.create(user=author, author=reader)
+        Follow.objects.create(user=reader, author=author)
+        for number in range(15):
+            post = Post.objects.create(author=author, group=group,
+                                       text=f'план {number}')
+            Comment.objects.create(post=post, author=reader, text='Да')
+        for number in range(12):
+            Comment.objects.create(post=post, author=reader,
+                                   text=f'Ещё {number}')
+        # лента подписок plan_author длиннее одной страницы
+        for number in range(12):
+            Post.objects.create(author=reader, text=f'ответ {number}')
+        # у plan_star больше всех подписчиков: при проверке гибридной
+        # ленты он становится «звездой»
+        star = User.objects.create_user(username='plan_star')
+        Follow.objects.create(user=author, author=star)
+        Follow.objects.create(user=reader, author=star)
+        for number in range(12):
+            Post.objects.create(author=star, text=f'звезда {number}')
+
+    def test_no_scans_or_temp_sorts(self):
+        """Запросы страниц используют индексы и не сортируют в памяти."""
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('Все запросы используют индексы', out.getvalue())
+
+    def test_hybrid_timeline_reads_page_from_each_source(self):
+        """Лента подписчика «звезды» читает из каждого источника
+        только страницу и сливает их по дате."""
+        author = User.objects.get(username='plan_author')
+        star = User.objects.get(username='plan_star')
+        client = Client()
+        client.force_login(author)
+        url = reverse('posts:follow_index')
+        with override_settings(FOLLOW_FANOUT_LIMIT=1):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url, {'cursor': ''})
+        page = response.context['page_obj']
+        expected = list(Post.objects.filter(
+            author__in=[star, User.objects.get(username='plan_reader')])
+            .order_by('-pub_date', '-pk')[:len(page)])
+        self.assertEqual(list(page), expected)
+        self.assertTrue(page.has_next())
+        feeds = [query['sql'] for query in queries.captured_queries
+                 if 'ORDER BY "feed_date" DESC' in query['sql']]
+        # материализованная лента и одна «звезда»
+        self.assertEqual(len(feeds), 2)
+        for sql in feeds:
+            self.assertIn('LIMIT 11', sql)
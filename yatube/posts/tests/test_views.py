@@ -1,13 +1,29 @@
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
-from posts.models import Post, Group, Comment, Follow
+from core import tasks
+from core.models import Task
+from posts import (cards, follows, storage, suggestions, thumbnails,
+                   timeline)
+from posts.models import (Post, Group, Comment, CoFollow, Follow, Suggestion,
+                          TimelineEntry, UserStats)
+from posts.utils import NEXT, decode_cursor, encode_cursor
 from django import forms
+import os
 import tempfile
 from django.conf import settings
 import shutil
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.images import ImageFile
+import csv
+import io
+import json
+from unittest import mock
 
 User = get_user_model()
 TEST_NUM = 10
@@ -195,17 +211,32 @@ class PostViewsTest(TestCase):
         self.assertRedirects(response, '/auth/login/?next=/posts/1/comment/')
 
     def test_cashe(self):
-        """Проверка кеша."""
+        """Карточки кешируются, но изменения видны в лентах сразу."""
         response_1 = self.guest_client.get(reverse('posts:index'))
-        obj_1 = response_1.content
-        Post.objects.get(pk=1).delete()
+        self.assertContains(response_1, 'Тестовый пост')
+        self.assertTrue(cache.get(cards.card_key(self.post)))
+
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Изменённый пост'
+        post.save()
         response_2 = self.guest_client.get(reverse('posts:index'))
-        obj_2 = response_2.content
-        self.assertEqual(obj_1, obj_2)
-        cache.clear()
-        response_3 = self.guest_client.get(reverse('posts:index'))
-        obj_3 = response_3.content
-        self.assertNotEqual(obj_3, obj_2)
+        self.assertContains(response_2, 'Изменённый пост')
+
+        Comment.objects.create(post=post, author=self.user, text='Ещё')
+        response_3 = self.guest_client.get(
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}))
+        self.assertContains(response_3, 'Комментариев: 1')
+
+        group = Group.objects.get(pk=self.group.pk)
+        group.slug = 'new-slug'
+        group.save()
+        response_4 = self.guest_client.get(
+            reverse('posts:profile', kwargs={'username': self.user}))
+        self.assertContains(response_4, '/group/new-slug/')
+
+        post.delete()
+        response_5 = self.guest_client.get(reverse('posts:index'))
+        self.assertNotContains(response_5, 'Изменённый пост')
 
     def test_follow_psge(self):
         """Проверка страницы подписок."""
@@ -283,6 +314,91 @@ class PostImageTests(TestCase):
         obj = response.context['page_obj'][0]
         self.assertEqual(obj.image, self.post.image)
 
+    def test_thumbnail_is_not_rendered_in_request(self):
+        """Шаблон показывает заглушку, пока миниатюра не создана в фоне."""
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}))
+        self.assertContains(response, 'thumbnail-placeholder.svg')
+        self.assertFalse(os.path.exists(
+            os.path.join(TEMP_MEDIA_ROOT, 'cache')))
+
+        thumbnails.generate(self.post.image.name)
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}))
+        self.assertNotContains(response, 'thumbnail-placeholder.svg')
+        self.assertContains(response, '<picture>')
+        for width in thumbnails.WIDTHS:
+            self.assertContains(response, f' {width}w')
+
+    @override_settings(TASKS_EAGER=False)
+    def test_broken_image_is_not_requeued(self):
+        """Картинка, которую не удалось обработать, не ставится в
+        очередь при каждом показе."""
+        cache.clear()
+        name = storage.post_images.save('posts/broken.gif',
+                                        SimpleUploadedFile('broken.gif',
+                                                           b'not a gif'))
+        with self.assertLogs('posts.thumbnails', 'ERROR'):
+            thumbnails.generate(name)
+        with mock.patch.object(thumbnails, 'PENDING_TIMEOUT', 0):
+            thumbnails.schedule(name)
+        self.assertFalse(Task.objects.filter(
+            name='posts.thumbnails.generate').exists())
+        thumbnails.reset(name)
+        thumbnails.schedule(name)
+        self.assertTrue(Task.objects.filter(
+            name='posts.thumbnails.generate').exists())
+
+    def test_identical_uploads_share_file(self):
+        """Одинаковые загрузки ссылаются на один файл по хешу."""
+        copy = Post.objects.create(
+            author=self.user, text='Копия',
+            image=SimpleUploadedFile('copy.gif', self.imaging))
+        self.assertEqual(copy.image.name, self.post.image.name)
+        self.assertRegex(copy.image.name, r'^posts/[0-9a-f]{2}/[0-9a-f]{64}')
+        directory = os.path.dirname(self.post.image.path)
+        self.assertEqual(os.listdir(directory),
+                         [os.path.basename(self.post.image.path)])
+
+    def test_file_released_with_last_post(self):
+        """Файл удаляется вместе с последним постом, который на него
+        ссылается."""
+        image = SimpleUploadedFile('own.gif', self.imaging + b'own')
+        first = Post.objects.create(author=self.user, text='1', image=image)
+        second = Post.objects.create(author=self.user, text='2',
+                                     image=first.image.name)
+        path = first.image.path
+        os.utime(path, (0, 0))
+        first.delete()
+        storage.release(first.image.name)
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        storage.release(first.image.name)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + '.released'))
+
+    def test_release_keeps_file_reused_meanwhile(self):
+        """Загрузка того же файла во время release не теряет его."""
+        image = SimpleUploadedFile('race.gif', self.imaging + b'race')
+        post = Post.objects.create(author=self.user, text='1', image=image)
+        name, path = post.image.name, post.image.path
+        post.delete()
+        os.utime(path, (0, 0))
+        replace = os.replace
+
+        def upload_between(source, target):
+            replace(source, target)
+            if source == path:
+                Post.objects.create(
+                    author=self.user, text='2',
+                    image=SimpleUploadedFile('again.gif',
+                                             self.imaging + b'race'))
+
+        with mock.patch('posts.storage.os.replace', upload_between):
+            storage.release(name)
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(Post.objects.filter(image=name).exists())
+
     def test_image_in_index_and_profile_page(self):
         """Изображение передается на главную страницу, а также профайла."""
         templates = (
@@ -294,3 +410,901 @@ class PostImageTests(TestCase):
                 response = self.guest_client.get(url)
                 object = response.context['page_obj'][0]
                 self.assertEqual(object.image, self.post.image)
+
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='cursor')
+        Post.objects.bulk_create(
+            Post(author=cls.user, text=f'Пост {i}') for i in range(25)
+        )
+
+    def setUp(self):
+        self.guest_client = Client()
+        cache.clear()
+
+    def test_cursor_pages_walk_whole_feed(self):
+        """Курсоры проходят всю ленту без пропусков и повторов."""
+        url = reverse('posts:profile', kwargs={'username': self.user})
+        seen = []
+        response = self.guest_client.get(url, {'cursor': ''})
+        while True:
+            page_obj = response.context['page_obj']
+            seen.extend(post.pk for post in page_obj)
+            if not page_obj.has_next():
+                break
+            response = self.guest_client.get(
+                url, {'cursor': page_obj.next_cursor})
+        expected = list(Post.objects.filter(author=self.user)
+                        .order_by('-pub_date', '-pk')
+                        .values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_cursor_previous_page(self):
+        """Курсор назад возвращает предыдущую страницу."""
+        url = reverse('posts:profile', kwargs={'username': self.user})
+        first = self.guest_client.get(url, {'cursor': ''})
+        first_page = first.context['page_obj']
+        self.assertFalse(first_page.has_previous())
+        second = self.guest_client.get(
+            url, {'cursor': first_page.next_cursor})
+        second_page = second.context['page_obj']
+        back = self.guest_client.get(
+            url, {'cursor': second_page.previous_cursor})
+        self.assertEqual(list(back.context['page_obj']), list(first_page))
+        self.assertFalse(back.context['page_obj'].has_previous())
+
+    def test_broken_cursor_gives_first_page(self):
+        """Битый курсор не ломает страницу."""
+        response = self.guest_client.get(
+            reverse('posts:profile', kwargs={'username': self.user}),
+            {'cursor': 'мусор'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+    def test_cursor_with_huge_id_gives_first_page(self):
+        """id за пределами BIGINT делает курсор битым, а не ошибкой."""
+        moment = Post.objects.latest('pub_date').pub_date
+        for pk in (2 ** 63, -2 ** 63 - 1, 10 ** 30):
+            with self.subTest(pk=pk):
+                cursor = encode_cursor(NEXT, moment, pk)
+                self.assertIsNone(decode_cursor(cursor))
+                response = self.guest_client.get(
+                    reverse('posts:profile', kwargs={'username': self.user}),
+                    {'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context['page_obj']), 10)
+        cursor = encode_cursor(NEXT, moment, 2 ** 63 - 1)
+        self.assertIsNotNone(decode_cursor(cursor))
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='writer')
+        cls.old_post = Post.objects.create(author=cls.author, text='Старый')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def feed(self):
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_follow_backfills_and_unfollow_cleans_timeline(self):
+        """Подписка заполняет ленту, отписка очищает её."""
+        self.reader_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': self.author}))
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=self.old_post).exists())
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+
+        self.reader_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': self.author}))
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(self.feed(), [])
+
+    def test_rebuild_after_bulk_create(self):
+        """Ленты собираются заново после загрузки в обход сигналов."""
+        Follow.objects.bulk_create(
+            [Follow(user=self.reader, author=self.author)])
+        self.assertFalse(TimelineEntry.objects.exists())
+        timeline.rebuild()
+        self.assertEqual(self.feed(), [self.old_post])
+
+    @override_settings(FOLLOW_FANOUT_LIMIT=0)
+    def test_celebrity_posts_are_read_at_request_time(self):
+        """Посты «звёзд» не раскладываются, но попадают в ленту."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+
+    def test_author_with_followers_can_be_deleted(self):
+        """Автора с подписчиками можно удалить вместе с подписками."""
+        author = User.objects.create_user(username='leaving')
+        Post.objects.create(author=author, text='Прощальный')
+        Follow.objects.create(user=self.reader, author=author)
+        author.delete()
+        self.assertFalse(Follow.objects.filter(user=self.reader).exists())
+        self.assertFalse(UserStats.objects.filter(user_id=author.pk).exists())
+
+    @override_settings(FOLLOW_FANOUT_LIMIT=1, TASKS_EAGER=False)
+    def test_former_celebrity_posts_restored(self):
+        """Посты, вышедшие в режиме «звезды», остаются в ленте после него."""
+        fan = User.objects.create_user(username='passing_fan')
+        Follow.objects.create(user=fan, author=self.author)
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        self.assertFalse(TimelineEntry.objects.filter(
+            post=new_post).exists())
+        Follow.objects.filter(user=fan).delete()
+        task = Task.objects.get(name='posts.timeline.restore')
+        tasks.call(task.name, task.payload)
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+
+
+class FollowCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='fan')
+        cls.author = User.objects.create_user(username='star')
+        cls.other = User.objects.create_user(username='other_fan')
+        Follow.objects.create(user=cls.other, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def following(self):
+        response = self.reader_client.get(
+            reverse('posts:profile', kwargs={'username': self.author}))
+        return response.context['following']
+
+    def test_button_follows_request_user(self):
+        """Кнопка зависит от подписок зрителя, а не от подписчиков автора."""
+        self.assertFalse(self.following())
+        self.reader_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': self.author}))
+        self.assertTrue(self.following())
+        self.reader_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': self.author}))
+        self.assertFalse(self.following())
+
+    def test_is_following_reads_cache(self):
+        """Проверка подписки после первой не обращается к базе."""
+        self.assertTrue(follows.is_following(self.other.pk, self.author.pk))
+        with self.assertNumQueries(0):
+            self.assertTrue(follows.is_following(self.other.pk,
+                                                 self.author.pk))
+            self.assertFalse(follows.is_following(self.other.pk,
+                                                  self.reader.pk))
+
+    def test_repeated_follow_skips_database(self):
+        """Повторная подписка не пишет в базу."""
+        url = reverse('posts:profile_follow',
+                      kwargs={'username': self.author})
+        self.reader_client.get(url)
+        follows.followed_ids(self.reader.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.reader_client.get(url)
+        self.assertFalse(any('posts_follow' in query['sql']
+                             for query in queries.captured_queries))
+        self.assertEqual(Follow.objects.filter(user=self.reader).count(), 1)
+
+    def test_large_sets_use_subquery(self):
+        """Очень большой набор подписок не попадает в IN параметрами."""
+        self.assertEqual(follows.authors_filter(self.other.pk),
+                         [self.author.pk])
+        with mock.patch.object(follows, 'IN_LIMIT', 0):
+            self.assertIn('SELECT', str(
+                follows.authors_filter(self.other.pk).query))
+
+
+@override_settings(TASKS_EAGER=False)
+class SuggestionTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='newcomer')
+        cls.authors = {name: User.objects.create_user(username=name)
+                       for name in ('popular', 'second', 'third', 'lonely')}
+        cls.fans = [User.objects.create_user(username=f'fan_{number}')
+                    for number in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        # fan_0 и fan_1 читают popular и second, fan_2 - popular и third
+        for fan, names in zip(self.fans, (('popular', 'second'),
+                                          ('popular', 'second'),
+                                          ('popular', 'third'))):
+            for name in names:
+                self.follow(fan, name)
+        self.run_tasks()
+
+    def follow(self, user, name):
+        Follow.objects.create(user=user, author=self.authors[name])
+
+    def unfollow(self, user, name):
+        Follow.objects.filter(user=user, author=self.authors[name]).delete()
+
+    def run_tasks(self):
+        """Выполняет поставленные задачи, как это сделал бы воркер."""
+        for task in Task.objects.order_by('pk'):
+            tasks.call(task.name, task.payload)
+            task.delete()
+
+    def cofollows(self):
+        return set(CoFollow.objects.values_list('author', 'other', 'count'))
+
+    def test_suggestions_ranked_by_common_followers(self):
+        """Предлагаются авторы с большим числом общих подписчиков."""
+        self.follow(self.reader, 'popular')
+        self.run_tasks()
+        self.assertEqual(suggestions.for_user(self.reader),
+                         [self.authors['second'], self.authors['third']])
+        with self.assertNumQueries(1):
+            suggestions.for_user(self.reader)
+
+    def test_incremental_matches_rebuild(self):
+        """Пересчёт с нуля даёт то же, что поддерживали сигналы."""
+        self.follow(self.reader, 'popular')
+        self.follow(self.reader, 'lonely')
+        self.run_tasks()
+        incremental = self.cofollows()
+        served = suggestions.for_user(self.reader)
+        suggestions.rebuild()
+        self.assertEqual(self.cofollows(), incremental)
+        self.assertEqual(suggestions.for_user(self.reader), served)
+
+    def test_queued_changes_match_rebuild(self):
+        """
+        Задачи, выполненные после нескольких подписок и отписок,
+        дают те же счётчики, что и пересчёт с нуля.
+        """
+        self.follow(self.reader, 'popular')
+        self.follow(self.reader, 'second')
+        self.follow(self.reader, 'lonely')
+        self.unfollow(self.fans[0], 'popular')
+        self.unfollow(self.fans[0], 'second')
+        self.unfollow(self.reader, 'lonely')
+        self.run_tasks()
+        incremental = self.cofollows()
+        suggestions.rebuild()
+        self.assertEqual(self.cofollows(), incremental)
+
+    def test_unfollow_undoes_follow(self):
+        """Отписка возвращает счётчики к прежним значениям."""
+        before = self.cofollows()
+        self.follow(self.fans[2], 'second')
+        self.run_tasks()
+        self.unfollow(self.fans[2], 'second')
+        self.run_tasks()
+        self.assertEqual(self.cofollows(), before)
+
+    def test_followed_authors_not_suggested(self):
+        """Авторы, на которых уже подписан, не предлагаются."""
+        self.follow(self.reader, 'popular')
+        self.follow(self.reader, 'second')
+        self.run_tasks()
+        self.assertEqual(suggestions.for_user(self.reader),
+                         [self.authors['third']])
+        client = Client()
+        client.force_login(self.reader)
+        response = client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.context['suggestions'],
+                         [self.authors['third']])
+        self.assertFalse(Suggestion.objects.filter(
+            user=self.reader, author=self.authors['second']).exists())
+
+    def test_refresh_invalidates_profile_etag(self):
+        """Новые предложения меняют ETag профиля у того, кому они."""
+        client = Client()
+        client.force_login(self.reader)
+        url = reverse('posts:profile', kwargs={'username': 'lonely'})
+        etag = client.get(url)['ETag']
+        self.follow(self.reader, 'popular')
+        self.run_tasks()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['suggestions'],
+                         [self.authors['second'], self.authors['third']])
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='etag')
+        cls.group = Group.objects.create(title='Группа', slug='etag-group',
+                                         description='Описание')
+        cls.post = Post.objects.create(author=cls.user, text='Пост',
+                                       group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def revalidate(self, url):
+        etag = self.guest_client.get(url)['ETag']
+        return self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_pages_are_not_rendered(self):
+        """Без изменений страницы отвечают 304 без рендеринга шаблона."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.revalidate(url)
+                self.assertEqual(response.status_code, 304)
+                self.assertFalse(response.templates)
+
+    def test_no_last_modified_for_user_pages(self):
+        """Страница, зависящая от пользователя, не отвечает 304
+        по одному If-Modified-Since."""
+        url = reverse('posts:index')
+        response = self.guest_client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(
+            url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_changes_invalidate_etag(self):
+        """Новый пост, правка и комментарий меняют ETag."""
+        index = reverse('posts:index')
+        detail = reverse('posts:post_detail',
+                         kwargs={'post_id': self.post.pk})
+        etag = self.guest_client.get(index)['ETag']
+        Post.objects.create(author=self.user, text='Ещё пост')
+        response = self.guest_client.get(index, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = self.guest_client.get(detail)['ETag']
+        Comment.objects.create(post=self.post, author=self.user, text='Да')
+        response = self.guest_client.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        group = reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        etag = self.guest_client.get(group)['ETag']
+        post = Post.objects.get(pk=self.post.pk)
+        post.group = None
+        post.save()
+        response = self.guest_client.get(group, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_comment_edit_invalidates_etag(self):
+        """Правка комментария, например в админке, меняет ETag поста."""
+        comment = Comment.objects.create(post=self.post, author=self.user,
+                                         text='Было')
+        detail = reverse('posts:post_detail',
+                         kwargs={'post_id': self.post.pk})
+        etag = self.guest_client.get(detail)['ETag']
+        comment.text = 'Стало'
+        comment.save()
+        response = self.guest_client.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Стало')
+        self.assertEqual(
+            Post.objects.get(pk=self.post.pk).comments_count, 1)
+
+    def test_etag_depends_on_user(self):
+        """Шапка страницы своя у каждого пользователя."""
+        url = reverse('posts:index')
+        etag = self.guest_client.get(url)['ETag']
+        self.guest_client.force_login(self.user)
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class CommentsPageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='commentator')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+        for i in range(15):
+            Comment.objects.create(post=cls.post, author=cls.user,
+                                   text=f'Комментарий {i}')
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_comments_are_paginated_newest_first(self):
+        """Комментарии на post_detail разбиты на страницы от новых к старым."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        first = self.guest_client.get(url).context['comments']
+        self.assertEqual(len(first), 10)
+        self.assertEqual(first[0].text, 'Комментарий 14')
+        second = self.guest_client.get(
+            url, {'comments': first.next_cursor}).context['comments']
+        self.assertEqual(len(second), 5)
+        self.assertFalse(second.has_next())
+
+    def test_comments_count_is_stored_on_post(self):
+        """Число комментариев хранится в посте и обновляется."""
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 15)
+        Comment.objects.filter(post=self.post).first().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 14)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='searcher')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Про <b>котиков</b> и собак')
+        Post.objects.create(author=cls.user, text='Совсем другое')
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def search(self, query):
+        response = self.guest_client.get(reverse('posts:search'),
+                                         {'q': query})
+        return list(response.context['page_obj'])
+
+    def test_search_finds_and_highlights(self):
+        """Поиск находит пост и безопасно подсвечивает совпадение."""
+        found = self.search('котиков')
+        self.assertEqual(found, [self.post])
+        self.assertIn('<mark>котиков</mark>', found[0].snippet)
+        self.assertIn('&lt;b&gt;', found[0].snippet)
+
+    def test_search_index_follows_edits_and_deletes(self):
+        """Индекс обновляется при изменении и удалении поста."""
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Теперь про хомяков'
+        post.save()
+        self.assertEqual(self.search('котиков'), [])
+        self.assertEqual(self.search('хомяков'), [post])
+        post.delete()
+        self.assertEqual(self.search('хомяков'), [])
+
+    def test_search_survives_query_syntax(self):
+        """Служебные символы FTS в запросе не ломают страницу."""
+        self.assertEqual(self.search('"котиков* ('), [self.post])
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='owner')
+        cls.other = User.objects.create_user(username='other')
+        cls.group = Group.objects.create(title='Группа', slug='export',
+                                         description='Описание')
+        for number in range(5):
+            post = Post.objects.create(author=cls.user, group=cls.group,
+                                       text=f'Пост {number}')
+            Comment.objects.create(post=post, author=cls.user,
+                                   text=f'Свой {number}')
+            Comment.objects.create(post=post, author=cls.other,
+                                   text=f'Чужой {number}')
+        Post.objects.create(author=cls.other, text='Не мой')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.url = reverse('posts:profile_export',
+                           kwargs={'username': self.user.username})
+
+    def records(self, *args):
+        response = self.client.get(*args)
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode()
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_export_has_only_own_content(self):
+        """В архиве только посты и комментарии владельца."""
+        found = self.records(self.url)
+        self.assertEqual([item['type'] for item in found],
+                         ['post'] * 5 + ['comment'] * 5)
+        self.assertEqual({item['author'] for item in found}, {'owner'})
+        self.assertEqual(found[0]['group'], 'export')
+
+    def test_export_resumes_from_cursor(self):
+        """Выгрузка продолжается со следующей после курсора записи."""
+        full = self.records(self.url)
+        rest = self.records(self.url, {'cursor': full[6]['cursor']})
+        self.assertEqual(rest, full[7:])
+        self.assertEqual(
+            self.client.get(self.url, {'cursor': 'битый'}).status_code, 400)
+
+    def test_export_csv(self):
+        """CSV содержит заголовок и строку на каждую запись."""
+        response = self.client.get(self.url, {'format': 'csv'})
+        body = b''.join(response.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0]['text'], 'Пост 0')
+
+    def test_export_only_for_owner(self):
+        """Чужой архив недоступен."""
+        self.client.force_login(self.other)
+        response = self.client.get(self.url)
+        self.assertRedirects(response, reverse(
+            'posts:profile', kwargs={'username': self.user.username}))
+
+    def test_export_site_command(self):
+        """Команда выгружает весь сайт и продолжает по курсору."""
+        out = io.StringIO()
+        call_command('export_site', stdout=out)
+        found = [json.loads(line) for line in out.getvalue().splitlines()]
+        kinds = [item['type'] for item in found]
+        self.assertEqual(kinds.count('post'), 6)
+        self.assertEqual(kinds.count('comment'), 10)
+        self.assertEqual(kinds.index('user'), 0)
+        out = io.StringIO()
+        call_command('export_site', cursor=found[3]['cursor'], stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()),
+                         len(found) - 4)
+
+
+class ImportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.existing = User.objects.create_user(username='existing')
+
+    def setUp(self):
+        cache.clear()
+
+    def run_import(self, records):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson',
+                                         delete=False) as source:
+            for record in records:
+                source.write(json.dumps(record) + '\n')
+        self.addCleanup(os.remove, source.name)
+        call_command('import_posts', source.name, batch_size=2,
+                     stdout=io.StringIO())
+
+    def test_import_keeps_dates_and_links(self):
+        """Импорт сохраняет даты и связывает записи по ключам источника."""
+        self.run_import([
+            {'type': 'user', 'id': 7, 'username': 'imported'},
+            {'type': 'group', 'id': 3, 'slug': 'old', 'title': 'Старая'},
+            {'type': 'post', 'id': 70, 'author': 'imported', 'group': 'old',
+             'pub_date': '2015-03-01T10:00:00.123456+00:00',
+             'text': 'Старый пост'},
+            {'type': 'post', 'id': 71, 'author': 'existing',
+             'pub_date': '2015-03-02T10:00:00+00:00', 'text': 'Второй'},
+            {'type': 'post', 'id': 72, 'author': 'nobody', 'text': 'Ничей'},
+            {'type': 'comment', 'id': 1, 'post': 70, 'author': 'existing',
+             'created': '2015-03-03T10:00:00+00:00', 'text': 'Ответ'},
+            {'type': 'follow', 'id': 1, 'user': 'existing',
+             'author': 'imported'},
+        ])
+        post = Post.objects.get(text='Старый пост')
+        self.assertEqual(post.pub_date.isoformat(),
+                         '2015-03-01T10:00:00.123456+00:00')
+        self.assertEqual(post.author.username, 'imported')
+        self.assertEqual(post.group.slug, 'old')
+        self.assertFalse(Post.objects.filter(text='Ничей').exists())
+        comment = post.comments.get()
+        self.assertEqual(comment.created.year, 2015)
+        self.assertEqual(post.comments_count, 1)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.existing, post=post).exists())
+
+    def test_import_refreshes_only_touched_users(self):
+        """Импорт пересчитывает счётчики только затронутых пользователей,
+        а новые посты получают следующие свободные id."""
+        bystander = User.objects.create_user(username='bystander')
+        last = Post.objects.create(author=bystander, text='Живой пост')
+        UserStats.objects.filter(user=bystander).update(posts_count=5)
+        self.run_import([
+            {'type': 'post', 'id': 1, 'author': 'existing', 'text': 'Один'},
+        ])
+        self.assertEqual(UserStats.objects.get(user=bystander).posts_count,
+                         5)
+        self.assertEqual(UserStats.objects.get(
+            user=self.existing).posts_count, 1)
+        self.assertGreater(Post.objects.get(text='Один').pk, last.pk)
+        self.assertGreater(Post.objects.create(author=bystander,
+                                               text='Ещё').pk,
+                           Post.objects.get(text='Один').pk)
+
+    def test_imported_posts_are_searchable(self):
+        """Полнотекстовый индекс видит загруженные посты."""
+        self.run_import([
+            {'type': 'post', 'id': 1, 'author': 'existing',
+             'text': 'Редкое слово перепелка'},
+        ])
+        response = self.client.get(reverse('posts:search'),
+                                   {'q': 'перепелка'})
+        self.assertEqual(len(response.context['page_obj']), 1)
+
+
+class FeedTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='feeder')
+        cls.group = Group.objects.create(title='Лента', slug='feed',
+                                         description='Описание')
+        cls.post = Post.objects.create(author=cls.user, group=cls.group,
+                                       text='Пост для ленты')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def urls(self):
+        return (
+            reverse('posts:site_rss'),
+            reverse('posts:site_atom'),
+            reverse('posts:group_rss', kwargs={'slug': self.group.slug}),
+            reverse('posts:group_atom', kwargs={'slug': self.group.slug}),
+            reverse('posts:author_rss',
+                    kwargs={'username': self.user.username}),
+            reverse('posts:author_atom',
+                    kwargs={'username': self.user.username}),
+        )
+
+    def test_feeds_list_posts(self):
+        """Ленты RSS и Atom содержат посты."""
+        for url in self.urls():
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Пост для ленты', response.content.decode())
+                self.assertIn('xml', response['Content-Type'])
+
+    def test_repeated_poll_is_cached(self):
+        """Повторный опрос не обращается к базе."""
+        for url in self.urls():
+            with self.subTest(url=url):
+                self.guest_client.get(url)
+                with self.assertNumQueries(0):
+                    response = self.guest_client.get(url)
+                self.assertIn('Пост для ленты', response.content.decode())
+
+    def test_links_follow_request_host(self):
+        """Ленты для разных хостов кешируются отдельно."""
+        url = reverse('posts:site_rss')
+        self.guest_client.get(url)
+        response = self.guest_client.get(url, HTTP_HOST='localhost',
+                                         secure=True)
+        self.assertIn('https://localhost/', response.content.decode())
+        self.assertNotIn('testserver', response.content.decode())
+
+    def test_new_post_invalidates_feed(self):
+        """Новый пост сразу виден в лентах сайта, группы и автора."""
+        for url in self.urls():
+            self.guest_client.get(url)
+        Post.objects.create(author=self.user, group=self.group,
+                            text='Свежий пост')
+        for url in self.urls():
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertIn('Свежий пост', response.content.decode())
+
+    def test_if_modified_since(self):
+        """Неизменившаяся лента отвечает 304 на If-Modified-Since."""
+        url = reverse('posts:site_rss')
+        last_modified = self.guest_client.get(url)['Last-Modified']
+        response = self.guest_client.get(
+            url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_group_feed(self):
+        """Лента несуществующей группы отдаёт 404."""
+        response = self.guest_client.get(
+            reverse('posts:group_rss', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class DedupeMediaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='legacy')
+        os.makedirs(os.path.join(TEMP_MEDIA_ROOT, 'posts'), exist_ok=True)
+        for name, content in (('a.gif', b'meme'), ('b.gif', b'meme'),
+                              ('c.gif', b'logo')):
+            with open(os.path.join(TEMP_MEDIA_ROOT, 'posts', name),
+                      'wb') as legacy:
+                legacy.write(content)
+            Post.objects.create(author=cls.user, text=name,
+                                image=f'posts/{name}')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        cache.clear()
+
+    def test_dry_run_changes_nothing(self):
+        """--dry-run только считает освобождаемое место."""
+        output = io.StringIO()
+        call_command('dedupe_media', '--dry-run', stdout=output)
+        self.assertIn('Можно освободить: 4 байт', output.getvalue())
+        self.assertTrue(Post.objects.filter(image='posts/a.gif').exists())
+
+    def test_duplicates_merged(self):
+        """Копии сливаются в один файл, старые имена удаляются."""
+        call_command('dedupe_media', stdout=io.StringIO())
+        names = dict(Post.objects.values_list('text', 'image'))
+        self.assertEqual(names['a.gif'], names['b.gif'])
+        self.assertNotEqual(names['a.gif'], names['c.gif'])
+        for name in names.values():
+            self.assertRegex(name, r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.gif$')
+            self.assertTrue(os.path.exists(
+                os.path.join(TEMP_MEDIA_ROOT, name)))
+        for legacy in ('a.gif', 'b.gif', 'c.gif'):
+            self.assertFalse(os.path.exists(
+                os.path.join(TEMP_MEDIA_ROOT, 'posts', legacy)))
+
+
+class GcMediaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='collector')
+        cls.imaging = (
+            b"\x47\x49\x46\x38\x39\x61\x02\x00"
+            b"\x01\x00\x80\x00\x00\x00\x00\x00"
+            b"\xFF\xFF\xFF\x21\xF9\x04\x00\x00"
+            b"\x00\x00\x00\x2C\x00\x00\x00\x00"
+            b"\x02\x00\x01\x00\x00\x02\x02\x0C"
+            b"\x0A\x00\x3B"
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.live = self.write('posts/live.gif')
+        Post.objects.create(author=self.user, text='Живой',
+                            image='posts/live.gif')
+        self.orphan = self.write('posts/orphan.gif')
+        self.thumbnail = get_thumbnail('posts/orphan.gif', '2x1')
+        self.thumbnail_path = os.path.join(self.media, self.thumbnail.name)
+        self.stray = self.write('cache/00/00/stray.jpg', b'stray')
+        # запись хранилища ключей о картинке, файл которой пропал
+        self.gone = self.write('posts/gone.gif')
+        get_thumbnail('posts/gone.gif', '2x1')
+        os.remove(self.gone)
+        for path in (self.live, self.orphan, self.thumbnail_path,
+                     self.stray):
+            os.utime(path, (0, 0))
+
+    def write(self, name, content=None):
+        path = os.path.join(self.media, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as target:
+            target.write(self.imaging if content is None else content)
+        return path
+
+    def gc(self, *args):
+        output = io.StringIO()
+        call_command('gc_media', '--rate', '0', *args, stdout=output)
+        return output.getvalue()
+
+    def stored(self, name):
+        return default.kvstore.get(ImageFile(name, default.storage))
+
+    def test_dry_run_changes_nothing(self):
+        """--dry-run показывает мусор и его размер, но не удаляет."""
+        output = self.gc('--dry-run')
+        # сирота с её миниатюрой и чужая миниатюра
+        reclaimed = (len(self.imaging) + os.path.getsize(self.thumbnail_path)
+                     + len(b'stray'))
+        self.assertIn(f'Можно освободить: {reclaimed} байт', output)
+        self.assertIn('posts/orphan.gif', output)
+        self.assertIn('stray.jpg', output)
+        self.assertIn('kvstore: posts/gone.gif', output)
+        for path in (self.orphan, self.thumbnail_path, self.stray):
+            self.assertTrue(os.path.exists(path))
+        self.assertIsNotNone(self.stored('posts/gone.gif'))
+
+    def test_garbage_removed(self):
+        """Сироты, их миниатюры, чужие миниатюры и записи о пропавших
+        файлах удаляются; картинка поста остаётся."""
+        self.gc()
+        self.assertTrue(os.path.exists(self.live))
+        for path in (self.orphan, self.thumbnail_path, self.stray):
+            self.assertFalse(os.path.exists(path))
+        self.assertIsNone(self.stored('posts/gone.gif'))
+        self.assertIsNone(self.stored('posts/orphan.gif'))
+
+    def test_min_age_protects_fresh_files(self):
+        """Файлы моложе --min-age не трогаются."""
+        fresh = self.write('posts/fresh.gif')
+        self.gc()
+        self.assertTrue(os.path.exists(fresh))
+        self.gc('--min-age', '0')
+        self.assertFalse(os.path.exists(fresh))
+        self.assertTrue(os.path.exists(self.live))
+
+
+class InlinePool:
+    """Пул без процессов: задачи выполняются в процессе теста."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, func, iterable):
+        return [func(item) for item in iterable]
+
+
+@mock.patch('posts.management.commands.warm_thumbnails.Pool', InlinePool)
+class WarmThumbnailsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='warmer')
+        cls.posts = [
+            Post.objects.create(author=cls.user, text=f'Пост {index}',
+                                image=f'posts/warm{index}.gif')
+            for index in range(5)
+        ]
+        cls.images = [post.image.name for post in cls.posts]
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.checkpoint = os.path.join(directory, 'checkpoint')
+
+    def warm(self, *args, side_effect=None):
+        with mock.patch.object(thumbnails, 'generate',
+                               side_effect=side_effect) as generate:
+            call_command('warm_thumbnails', '--chunk-size', '2',
+                         '--checkpoint', self.checkpoint, *args,
+                         stdout=io.StringIO())
+        return [call.args[0] for call in generate.call_args_list]
+
+    def interrupt(self):
+        """Прогон, прерванный на третьей картинке."""
+        calls = []
+
+        def generate(name):
+            calls.append(name)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.warm(side_effect=generate)
+        with open(self.checkpoint) as file:
+            self.assertEqual(int(file.read()), self.posts[1].pk)
+
+    def test_rerun_resumes_after_checkpoint(self):
+        """Повторный прогон продолжает после последнего готового куска."""
+        self.interrupt()
+        self.assertEqual(self.warm(), self.images[2:])
+
+    def test_restart_starts_over(self):
+        """--restart игнорирует контрольную точку."""
+        self.interrupt()
+        self.assertEqual(self.warm('--restart'), self.images)
+        with open(self.checkpoint) as file:
+            self.assertEqual(int(file.read()), self.posts[-1].pk)
@@ -0,0 +1,215 @@
+import logging
+
+from PIL import Image, features
+
+from django.core.cache import cache
+from django.core.cache.backends.base import BaseCache
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import EXTENSIONS, ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import (DummyImageFile, ImageFile,
+                                   deserialize_image_file)
+from sorl.thumbnail.kvstores.base import add_prefix
+
+logger = logging.getLogger(__name__)
+
+# исходная миниатюра шаблонов, с ней сравнивает отчёт image_savings
+DEFAULT_GEOMETRY = '960x339'
+DEFAULT_OPTIONS = {'crop': 'center', 'upscale': True}
+WIDTHS = (480, 720, 960)
+ASPECT = 339 / 960
+SIZES = '(max-width: 960px) 100vw, 960px'
+QUALITY = {'AVIF': 60, 'WEBP': 75, 'JPEG': 85}
+MIME_TYPES = {
+    'AVIF': 'image/avif',
+    'WEBP': 'image/webp',
+    'JPEG': 'image/jpeg',
+}
+PENDING_TIMEOUT = 60
+# картинка, которую не удалось обработать, столько не ставится в очередь
+FAILED_TIMEOUT = 24 * 60 * 60
+
+
+def pending_key(name):
+    return f'thumbnail-pending:{name}'
+
+
+def supported_formats():
+    """Форматы в порядке предпочтения; JPEG нужен всегда как запасной."""
+    formats = []
+    Image.init()
+    if 'AVIF' in Image.SAVE:
+        # sorl не знает расширения AVIF
+        EXTENSIONS.setdefault('AVIF', 'avif')
+        formats.append('AVIF')
+    if features.check('webp'):
+        formats.append('WEBP')
+    formats.append('JPEG')
+    return formats
+
+
+FORMATS = supported_formats()
+
+
+def variants():
+    """Все варианты картинки, которые используют шаблоны постов."""
+    for format_ in FORMATS:
+        for width in WIDTHS:
+            geometry = f'{width}x{round(width * ASPECT)}'
+            options = dict(DEFAULT_OPTIONS, format=format_,
+                           quality=QUALITY[format_],
+                           progressive=format_ == 'JPEG')
+            yield format_, width, geometry, options
+
+
+class LookupBackend(ThumbnailBackend):
+    """Бэкенд sorl, который умеет только искать готовую миниатюру."""
+
+    def thumbnail(self, file_, geometry_string, **options):
+        """
+        Повторяет подготовку опций из get_thumbnail и возвращает файл
+        миниатюры, не проверяя, создана ли она.
+        """
+        source = ImageFile(file_)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def lookup(self, file_, geometry_string, **options):
+        """Миниатюра из хранилища ключей или None, если её ещё нет."""
+        return default.kvstore.get(
+            self.thumbnail(file_, geometry_string, **options))
+
+
+backend = LookupBackend()
+
+
+def init_worker():
+    import django
+    from django.apps import apps
+    from django.db import connections
+
+    if not apps.ready:
+        django.setup()
+    # соединения, унаследованные при fork, принадлежат родителю
+    for conn in connections.all():
+        conn.close()
+
+
+def generate(name):
+    """Создаёт все варианты картинки; выполняется воркером очереди."""
+    # модели импортируются при вызове: модуль загружается
+    # в процессе пула warm_thumbnails до django.setup
+    from . import etags
+    from .models import Post
+
+    failed = False
+    for _, _, geometry, options in variants():
+        try:
+            thumbnail = get_thumbnail(name, geometry, **options)
+        except Exception:
+            failed = True
+            logger.exception('Не удалось создать миниатюру %s для %s',
+                             geometry, name)
+            continue
+        # ошибку чтения исходника sorl только пишет в лог и
+        # возвращает заглушку или несозданный файл
+        if isinstance(thumbnail, DummyImageFile) or not thumbnail.exists():
+            failed = True
+            logger.error('Не удалось создать миниатюру %s для %s',
+                         geometry, name)
+    if failed:
+        # иначе каждая страница с картинкой ставила бы её в очередь снова
+        cache.set(pending_key(name), True, FAILED_TIMEOUT)
+    # заглушка в уже отданных страницах сменится картинкой
+    etags.touch_posts(Post.objects.filter(image=name))
+
+
+def schedule(name):
+    """
+    Ставит генерацию миниатюр в очередь задач.
+
+    Повторная постановка той же картинки в течение PENDING_TIMEOUT
+    секунд отсекается кешем, не доходя до базы, а позже - ключом
+    задачи, пока та ждёт воркера или выполняется. Картинка, которую
+    generate не смог обработать, не ставится FAILED_TIMEOUT секунд.
+    """
+    from core import tasks
+
+    if not name or not cache.add(pending_key(name), True, PENDING_TIMEOUT):
+        return
+    tasks.enqueue(generate, args=[name], key=f'thumbnails:{name}')
+
+
+def reset(name):
+    """Снимает отметку о постановке: файл картинки записан заново."""
+    cache.delete(pending_key(name))
+
+
+def stored(keys):
+    """
+    Значения хранилища ключей sorl для многих ключей сразу: один
+    get_many к кешу и один запрос к базе вместо запросов на каждый ключ.
+    """
+    from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+    from sorl.thumbnail.models import KVStore
+
+    kvstore = default.kvstore
+    if not isinstance(getattr(kvstore, 'cache', None), BaseCache):
+        return {key: kvstore._get_raw(key) for key in keys}
+    values = kvstore.cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        found = dict(KVStore.objects.filter(key__in=missing)
+                     .values_list('key', 'value'))
+        fetched = {key: found.get(key, EMPTY_VALUE) for key in missing}
+        # как и sorl, запоминаем и отсутствие записи
+        kvstore.cache.set_many(fetched,
+                               sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(fetched)
+    return {key: None if value == EMPTY_VALUE else value
+            for key, value in values.items()}
+
+
+def cached_variants_many(images):
+    """
+    Готовые варианты картинок: {имя: {формат: [(url, ширина), ...]}}.
+
+    Картинки не декодируются: если запасного JPEG ещё нет, генерация
+    ставится в очередь, а шаблон показывает заглушку.
+    """
+    # по имени, как в generate: ключ sorl включает хранилище
+    # исходника, а миниатюры создаются из имени в хранилище по умолчанию
+    images = {image.name for image in images if image}
+    keys = {}
+    for name in images:
+        for format_, width, geometry, options in variants():
+            thumbnail = backend.thumbnail(name, geometry, **options)
+            keys[add_prefix(thumbnail.key)] = (name, format_, width)
+    values = stored(list(keys))
+    result = {name: {} for name in images}
+    for key, (name, format_, width) in keys.items():
+        if values.get(key) is not None:
+            url = deserialize_image_file(values[key]).url
+            result[name].setdefault(format_, []).append((url, width))
+    for name, found in result.items():
+        if len(found.get('JPEG', ())) < len(WIDTHS):
+            schedule(name)
+        if 'JPEG' not in found:
+            found.clear()
+    return result
+
+
+def cached_variants(image):
+    """Готовые варианты одной картинки: {формат: [(url, ширина), ...]}."""
+    if not image:
+        return {}
+    return cached_variants_many([image])[image.name]
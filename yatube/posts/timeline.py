@@ -0,0 +1,226 @@
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from . import stats
+from .follows import authors_filter
+from .models import Follow, Post, TimelineEntry, UserStats
+from .utils import field_value
+
+BATCH_SIZE = 500
+
+
+def fanout_limit():
+    return getattr(settings, 'FOLLOW_FANOUT_LIMIT', 1000)
+
+
+def is_celebrity(author_id):
+    """Слишком много подписчиков: посты автора читаются при запросе ленты."""
+    return stats.for_user(author_id).followers_count > fanout_limit()
+
+
+def celebrity_ids(user):
+    """id авторов-«звёзд», на которых подписан пользователь."""
+    return list(
+        UserStats.objects
+        .filter(user__in=authors_filter(user.pk),
+                followers_count__gt=fanout_limit())
+        .values_list('user', flat=True)
+    )
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_celebrity(post.author_id):
+        return
+    followers = (Follow.objects.filter(author_id=post.author_id)
+                 .values_list('user_id', flat=True))
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post,
+                       author_id=post.author_id, pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика уже опубликованные посты автора."""
+    if is_celebrity(author_id):
+        return
+    posts = (Post.objects.filter(author_id=author_id)
+             .values_list('pk', 'pub_date'))
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=pk,
+                       author_id=author_id, pub_date=pub_date)
+         for pk, pub_date in posts.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def fill(author_ids):
+    """
+    Добавляет в ленты подписчиков недостающие посты авторов author_ids,
+    кроме «звёзд»; остальные ленты не трогаются.
+    """
+    entries = TimelineEntry._meta.db_table
+    follows = Follow._meta.db_table
+    posts = Post._meta.db_table
+    user_stats = UserStats._meta.db_table
+    author_ids = sorted(author_ids)
+    for start in range(0, len(author_ids), BATCH_SIZE):
+        chunk = author_ids[start:start + BATCH_SIZE]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {entries} '
+                f'(user_id, post_id, author_id, pub_date) '
+                f'SELECT f.user_id, p.id, p.author_id, p.pub_date '
+                f'FROM {follows} f '
+                f'JOIN {posts} p ON p.author_id = f.author_id '
+                f'WHERE f.author_id IN ({", ".join(["%s"] * len(chunk))}) '
+                f'AND f.author_id NOT IN (SELECT user_id FROM {user_stats} '
+                f'WHERE followers_count > %s) '
+                f'AND NOT EXISTS (SELECT 1 FROM {entries} e '
+                f'WHERE e.user_id = f.user_id AND e.post_id = p.id)',
+                [*chunk, fanout_limit()],
+            )
+
+
+def restore(author_id):
+    """
+    Задача: раскладывает по лентам всех подписчиков посты автора,
+    который перестал быть «звездой». Пока он им был, записи в ленты
+    не попадали, а читаются они снова только из лент.
+    """
+    fill([author_id])
+
+
+def settle(author_id):
+    """
+    Вызывается после отписки: автор, опустившийся до порога
+    FOLLOW_FANOUT_LIMIT, получает задачу restore.
+    """
+    from core import tasks
+
+    # строка не создаётся: автор может удаляться каскадом вместе с ней
+    followers = (UserStats.objects.filter(user_id=author_id)
+                 .values_list('followers_count', flat=True).first())
+    if followers is None:
+        return
+    if followers == fanout_limit():
+        tasks.enqueue(restore, args=[author_id],
+                      key=f'timeline-restore:{author_id}')
+
+
+def drop(user_id, author_id):
+    """Убирает посты автора из ленты отписавшегося пользователя."""
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 author_id=author_id).delete()
+
+
+def rebuild():
+    """
+    Собирает ленты заново одним INSERT ... SELECT; нужна после
+    массовой загрузки через bulk_create, которая не вызывает сигналы.
+    """
+    entries = TimelineEntry._meta.db_table
+    follows = Follow._meta.db_table
+    posts = Post._meta.db_table
+    user_stats = UserStats._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {entries}')
+        cursor.execute(
+            f'INSERT INTO {entries} (user_id, post_id, author_id, pub_date) '
+            f'SELECT f.user_id, p.id, p.author_id, p.pub_date '
+            f'FROM {follows} f JOIN {posts} p ON p.author_id = f.author_id '
+            f'WHERE f.author_id NOT IN (SELECT user_id FROM {user_stats} '
+            f'WHERE followers_count > %s)',
+            [fanout_limit()],
+        )
+
+
+class MergedTimeline:
+    """
+    Лента из нескольких querysets, упорядоченных по (feed_date,
+    feed_post): материализованной ленты и постов каждой «звезды».
+
+    Срез читает из каждого источника не больше stop строк по его
+    индексу, а сливает их Python. Фильтры и сортировка применяются
+    ко всем источникам; этого хватает Paginator и cursor_page.
+    """
+    ordered = True
+
+    def __init__(self, sources, descending=True):
+        self.sources = sources
+        self.descending = descending
+
+    def _apply(self, method, *args, **kwargs):
+        return MergedTimeline(
+            [getattr(source, method)(*args, **kwargs)
+             for source in self.sources],
+            self.descending)
+
+    def select_related(self, *fields):
+        return self._apply('select_related', *fields)
+
+    def values(self, *fields):
+        return self._apply('values', *fields)
+
+    def filter(self, *args, **kwargs):
+        return self._apply('filter', *args, **kwargs)
+
+    def order_by(self, *fields):
+        merged = self._apply('order_by', *fields)
+        merged.descending = fields[0].startswith('-')
+        return merged
+
+    def count(self):
+        # источники не пересекаются: «звёзды» исключены из ленты
+        return sum(source.count() for source in self.sources)
+
+    @staticmethod
+    def position(row):
+        return field_value(row, 'feed_date'), field_value(row, 'feed_post')
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if index.stop is None or index.step is not None:
+            raise TypeError('Нужен срез с концом и без шага.')
+        rows = heapq.merge(*(source[:index.stop]
+                             for source in self.sources),
+                           key=self.position, reverse=self.descending)
+        return list(islice(rows, index.start, index.stop))
+
+
+def timeline_posts(user):
+    """
+    Лента подписок пользователя.
+
+    Посты обычных авторов берутся из материализованной ленты и
+    читаются индексом (user, pub_date, post) без сортировки. Для
+    подписчика «звёзд» (гибридный режим) к ней добавляются их посты,
+    каждая «звезда» читается индексом (author, pub_date), и страница
+    собирается MergedTimeline. Порядок задают поля feed_date и
+    feed_post.
+    """
+    order = ('-feed_date', '-feed_post')
+    posts = Post.objects.filter(timeline_entries__user=user).annotate(
+        feed_date=F('timeline_entries__pub_date'),
+        feed_post=F('timeline_entries__post'),
+    )
+    celebrities = celebrity_ids(user)
+    if not celebrities:
+        return posts.order_by(*order)
+    # записи «звёзд», оставшиеся с прошлых времён, не задваивают посты
+    sources = [posts.exclude(author_id__in=celebrities).order_by(*order)]
+    sources.extend(
+        Post.objects.filter(author_id=author_id)
+        .annotate(feed_date=F('pub_date'), feed_post=F('pk'))
+        .order_by(*order)
+        for author_id in celebrities)
+    return MergedTimeline(sources)
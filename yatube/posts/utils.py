@@ -0,0 +1,155 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+LIMIT_PAGE = 10
+NEXT = 'n'
+PREVIOUS = 'p'
+# id в курсоре сравнивается с BIGINT: больше не поместится в запрос
+MIN_PK = -2 ** 63
+MAX_PK = 2 ** 63 - 1
+
+
+def encode_cursor(direction, moment, pk):
+    """Упаковывает позицию (дата, id) в непрозрачный токен."""
+    raw = f'{direction}|{moment.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Распаковывает токен; для битого токена возвращает None."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, moment, pk = raw.decode().split('|')
+        moment = parse_datetime(moment)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if direction not in (NEXT, PREVIOUS) or moment is None:
+        return None
+    if not MIN_PK <= pk <= MAX_PK:
+        return None
+    return direction, moment, pk
+
+
+def field_value(obj, name):
+    """Поле записи: модели или словаря из values()."""
+    if isinstance(obj, dict):
+        return obj[name]
+    return getattr(obj, name)
+
+
+class CursorPage:
+    """
+    Страница keyset-пагинации по (дата, id).
+
+    Повторяет интерфейс Page, который нужен шаблонам, но не знает
+    ни номера страницы, ни общего числа записей.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None,
+                 param='cursor', query=''):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.param = param
+        # прочие GET-параметры страницы в виде 'q=...&'
+        self.query = query
+
+    def __repr__(self):
+        return f'<CursorPage: {len(self)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def cursor_page(object_list, token, per_page=LIMIT_PAGE,
+                field='pub_date', param='cursor', tiebreak='pk'):
+    """
+    Возвращает страницу записей после (или перед) позицией из токена.
+
+    Записи идут от новых к старым по (field, tiebreak). Берётся на одну
+    запись больше, чем нужно, чтобы без COUNT(*) узнать, есть ли
+    следующая страница.
+    """
+    cursor = decode_cursor(token) if token else None
+    if cursor is None:
+        direction, position = NEXT, None
+    else:
+        direction, moment, pk = cursor
+        position = (moment, pk)
+
+    if direction == NEXT:
+        object_list = object_list.order_by(f'-{field}', f'-{tiebreak}')
+        if position:
+            object_list = object_list.filter(
+                Q(**{f'{field}__lt': moment})
+                | Q(**{field: moment, f'{tiebreak}__lt': pk})
+            )
+    else:
+        object_list = object_list.order_by(field, tiebreak).filter(
+            Q(**{f'{field}__gt': moment})
+            | Q(**{field: moment, f'{tiebreak}__gt': pk})
+        )
+
+    objects = list(object_list[:per_page + 1])
+    has_more = len(objects) > per_page
+    objects = objects[:per_page]
+    if direction == PREVIOUS:
+        objects.reverse()
+
+    if not objects:
+        return CursorPage(objects, param=param)
+    first, last = objects[0], objects[-1]
+    has_next = has_more if direction == NEXT else True
+    has_previous = position is not None if direction == NEXT else has_more
+    return CursorPage(
+        objects,
+        next_cursor=(
+            encode_cursor(NEXT, field_value(last, field),
+                          field_value(last, tiebreak))
+            if has_next else None
+        ),
+        previous_cursor=(
+            encode_cursor(PREVIOUS, field_value(first, field),
+                          field_value(first, tiebreak))
+            if has_previous else None
+        ),
+        param=param,
+    )
+
+
+def pagination(request, post_list, field='pub_date', tiebreak='pk'):
+    """
+    Пагинация ленты постов.
+
+    Keyset-режим включается параметром ?cursor= в запросе или
+    настройкой POSTS_CURSOR_PAGINATION, иначе работает обычный Paginator.
+    """
+    if ('cursor' in request.GET
+            or getattr(settings, 'POSTS_CURSOR_PAGINATION', False)):
+        return cursor_page(post_list, request.GET.get('cursor'),
+                           field=field, tiebreak=tiebreak)
+    paginator = Paginator(post_list, LIMIT_PAGE)
+    page_number = request.GET.get('page')
+    return paginator.get_page(page_number)
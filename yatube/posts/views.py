@@ -1,27 +1,24 @@
-from django.core.paginator import Paginator
 from django.shortcuts import redirect, render, get_object_or_404
 from django.contrib.auth import get_user_model
+from django.http import (Http404, HttpResponseBadRequest,
+                         StreamingHttpResponse)
+from . import etags, export, follows, suggestions, thumbnails
 from .models import Post, Group, Follow
 from .forms import CommentForm, PostForm
+from .search import search_posts
+from .stats import for_user
+from .timeline import timeline_posts
+from .utils import cursor_page, pagination
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
+from django.utils.http import urlencode
 
 
 User = get_user_model()
-POSTS = 10
-LIMIT_PAGE = 10
 
 
-def pagination(request, post_list):
-    paginator = Paginator(post_list, LIMIT_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return page_obj
-
-
-@cache_page(20)
+@etags.conditional(etags.index_state)
 def index(request):
-    post_list = Post.objects.all()[:POSTS]
+    post_list = Post.objects.select_related('author', 'group')
     title = 'Последние обновления на сайте'
     text = "Это главная страница проекта Yatube"
     page_obj = pagination(request, post_list)
@@ -33,9 +30,10 @@ def index(request):
     return render(request, 'posts/index.html', context)
 
 
+@etags.conditional(etags.group_state)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.group_posts.all()[:POSTS]
+    posts = group.group_posts.select_related('author', 'group')
     page_obj = pagination(request, posts)
     title = 'Записи сообщества'
     text = "Здесь будет информация о группах проекта Yatube"
@@ -48,27 +46,59 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@etags.conditional(etags.profile_page_state)
 def profile(request, username):
     user = get_object_or_404(User, username=username)
-    post = (user.posts.select_related('group', 'author')
-            .filter(author__username=username))[:POSTS]
-    post_number = user.posts.count()
+    post = user.posts.select_related('group', 'author')
+    post_number = for_user(user.pk).posts_count
     page_obj = pagination(request, post)
-    following = user.following.exists()
+    following = (request.user.is_authenticated
+                 and follows.is_following(request.user.pk, user.pk))
     context = {
         'page_obj': page_obj,
         'author': user,
         'post_number': post_number,
-        'following': following
+        'following': following,
+        'suggestions': suggestions.for_user(request.user),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@login_required
+def profile_export(request, username):
+    # архив своих постов и комментариев; строки читаются из базы
+    # по мере отправки
+    author = get_object_or_404(User, username=username)
+    if author != request.user:
+        return redirect('posts:profile', username=username)
+    format_ = request.GET.get('format', 'ndjson')
+    if format_ not in export.FORMATS:
+        return HttpResponseBadRequest('Неизвестный формат.')
+    position = None
+    if request.GET.get('cursor'):
+        position = export.decode_cursor(request.GET['cursor'])
+        if position is None:
+            return HttpResponseBadRequest('Неверный курсор.')
+    response = StreamingHttpResponse(
+        export.lines(export.profile_sections(author), format_, position),
+        content_type=export.FORMATS[format_],
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{author.username}.{format_}"')
+    return response
+
+
+@etags.conditional(etags.post_state)
 def post_detail(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     form = CommentForm(request.POST or None)
-    comments = post.comments.all()
-    post_num = post.author.posts.count()
+    comments = cursor_page(
+        post.comments.select_related('author'),
+        request.GET.get('comments'),
+        field='created',
+        param='comments',
+    )
+    post_num = for_user(post.author_id).posts_count
     context = {
         'post': post,
         'post_num': post_num,
@@ -78,6 +108,21 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = search_posts(
+        query,
+        request.GET.get('cursor'),
+        extra_query=urlencode({'q': query}) + '&',
+    )
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'title': 'Поиск по записям',
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def post_create(request):
     if request.method == 'POST':
@@ -87,6 +132,7 @@ def post_create(request):
             post = form.save(commit=False)
             post.author = request.user
             post.save()
+            thumbnails.schedule(post.image.name)
             return redirect(f'/profile/{request.user}/')
         return render(request, 'posts/create_post.html', {'form': form})
     form = PostForm()
@@ -103,6 +149,8 @@ def post_edit(request, post_id):
                             instance=post)
             if form.is_valid():
                 form.save()
+                if 'image' in form.changed_data:
+                    thumbnails.schedule(post.image.name)
                 return redirect(f'/posts/{post_id}/')
 
         if request.method == 'GET':
@@ -140,11 +188,13 @@ def add_comment(request, post_id):
 @login_required
 def follow_index(request):
     # информация о текущем пользователе доступна в переменной request.user
-    posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = pagination(request, posts)
+    posts = timeline_posts(request.user).select_related('author', 'group')
+    page_obj = pagination(request, posts,
+                          field='feed_date', tiebreak='feed_post')
     context = {
         'page_obj': page_obj,
-        'title': 'Посты ваших любимых авторов'
+        'title': 'Посты ваших любимых авторов',
+        'suggestions': suggestions.for_user(request.user),
     }
     return render(request, 'posts/follow.html', context)
 
@@ -153,7 +203,8 @@ def follow_index(request):
 def profile_follow(request, username):
     # Подписаться на автора
     author = get_object_or_404(User, username=username)
-    if author != request.user:
+    if (author != request.user
+            and not follows.is_following(request.user.pk, author.pk)):
         Follow.objects.get_or_create(user=request.user, author=author)
     return redirect('posts:follow_index')
 
@@ -161,5 +212,7 @@ def profile_follow(request, username):
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
+    if not follows.is_following(request.user.pk, author.pk):
+        raise Http404
     get_object_or_404(Follow, user=request.user, author=author).delete()
     return redirect('posts:follow_index')
@@ -1,8 +1,16 @@
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.forms import PasswordResetForm, UserCreationForm
 from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.template import loader
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from core import tasks
 
 
 User = get_user_model()
+# части контекста письма, которые не сохраняются в очереди
+PRIVATE_CONTEXT = ('user', 'uid', 'token', 'email')
 
 
 class CreationForm(UserCreationForm):
@@ -10,3 +18,42 @@ class CreationForm(UserCreationForm):
 
         model = User
         fields = ('first_name', 'last_name', 'username', 'email')
+
+
+def send_password_reset(user_pk, context, subject_template_name,
+                        email_template_name, from_email, to_email,
+                        html_email_template_name=None):
+    """
+    Задача: письмо для сброса пароля. Ссылка с токеном создаётся
+    здесь, поэтому в аргументах задачи её нет.
+    """
+    user = User.objects.filter(pk=user_pk, is_active=True).first()
+    if user is None:
+        return
+    context = dict(context, user=user, email=to_email,
+                   uid=urlsafe_base64_encode(force_bytes(user.pk)),
+                   token=default_token_generator.make_token(user))
+    subject = loader.render_to_string(subject_template_name, context)
+    subject = ''.join(subject.splitlines())
+    body = loader.render_to_string(email_template_name, context)
+    html_body = None
+    if html_email_template_name is not None:
+        html_body = loader.render_to_string(html_email_template_name,
+                                            context)
+    tasks.send_email(subject, body, from_email, [to_email], html_body)
+
+
+class QueuedPasswordResetForm(PasswordResetForm):
+    """Письмо для сброса пароля отправляет воркер очереди."""
+
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email,
+                  html_email_template_name=None):
+        # в задачу уходят только id пользователя и адрес сайта
+        safe_context = {key: value for key, value in context.items()
+                        if key not in PRIVATE_CONTEXT}
+        tasks.enqueue(send_password_reset,
+                      args=[context['user'].pk, safe_context,
+                            subject_template_name, email_template_name,
+                            from_email, to_email, html_email_template_name],
+                      priority=tasks.HIGH)
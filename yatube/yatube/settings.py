@@ -10,7 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -40,6 +44,7 @@ INSTALLED_APPS = [
     'core.apps.CoreConfig',
     'about.apps.AboutConfig',
     'posts.apps.PostsConfig',
+    'api.apps.ApiConfig',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -50,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.QueryInspectorMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -146,8 +152,88 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# кеш в файле SQLite общий для всех процессов сервера: версии карточек
+# и миниатюр, записанные одним процессом, сразу видны остальным;
+# benchmark_cache сравнивает его с LocMemCache и FileBasedCache;
+# путь к файлу можно задать переменной окружения YATUBE_CACHE_PATH
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.environ.get(
+            'YATUBE_CACHE_PATH', os.path.join(BASE_DIR, 'cache.sqlite3')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
+# тесты очищают кеш: каждому запуску свой каталог для кеша и журнала,
+# файлы сервера не трогаются
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+if TESTING:
+    _TEST_DIR = tempfile.mkdtemp(prefix='yatube-test-')
+    atexit.register(shutil.rmtree, _TEST_DIR, ignore_errors=True)
+    CACHES['default']['LOCATION'] = os.path.join(_TEST_DIR, 'cache.sqlite3')
+
+# keyset-пагинация лент по (pub_date, id) вместо COUNT(*) и OFFSET;
+# в отдельном запросе включается параметром ?cursor=
+POSTS_CURSOR_PAGINATION = False
+
+# авторы с большим числом подписчиков не раскладываются по лентам
+# при публикации, их посты читаются в follow_index напрямую
+FOLLOW_FANOUT_LIMIT = 1000
+
+# фоновые задачи (миниатюры, письма) лежат в таблице core.Task и
+# выполняются командой run_worker; True - выполнять сразу после
+# фиксации транзакции в процессе, который их поставил, None - так же,
+# но только для базы SQLite в памяти, которую воркер не видит
+TASKS_EAGER = None
+# упавшая задача повторяется через TASK_RETRY_DELAY * 2^(попытка - 1)
+# секунд, но не реже чем раз в TASK_RETRY_MAX_DELAY
+TASK_RETRY_DELAY = 10
+TASK_RETRY_MAX_DELAY = 60 * 60
+# задача, которую воркер держит дольше, возвращается в очередь
+TASK_LEASE = 10 * 60
+
+# загруженные картинки пересжимаются: длинная сторона не больше
+# IMAGE_MAX_EDGE точек, JPEG с качеством IMAGE_QUALITY; картинки больше
+# IMAGE_MAX_PIXELS отклоняются по заголовку, до декодирования
+IMAGE_MAX_EDGE = 2048
+IMAGE_QUALITY = 85
+IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+
+# число и время запросов к базе в заголовке Server-Timing и журнале;
+# запрос одной формы, выполненный столько раз за запрос, - признак N+1.
+# Заголовок видят только сотрудники, а при DEBUG - все
+QUERY_INSPECTOR = True
+QUERY_REPEAT_THRESHOLD = 3
+# журнал запросов; путь можно задать переменной YATUBE_QUERY_LOG
+QUERY_LOG = (os.path.join(_TEST_DIR, 'queries.log') if TESTING
+             else os.environ.get('YATUBE_QUERY_LOG',
+                                 os.path.join(BASE_DIR, 'queries.log')))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'queries': {
+            'format': '{asctime} {levelname} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': QUERY_LOG,
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 3,
+            'formatter': 'queries',
+        },
+    },
+    'loggers': {
+        'core.queries': {
+            'handlers': ['queries'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -26,6 +26,7 @@ urlpatterns = [
     path('about/', include('about.urls', namespace='about')),
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),
+    path('api/v1/', include('api.urls', namespace='api')),
     path('', include('posts.urls', namespace='posts')),
     path('admin/', admin.site.urls),
 ]